@@ -0,0 +1,101 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+"""
+Benchmark the server top list aggregation against the old per-row dict implementation.
+
+Usage:
+    python -m benchmarks.server_aggregation [members] [artists_per_member]
+"""
+
+import random
+import sys
+from timeit import timeit
+
+from modules.aggregation import aggregate_top_lists
+
+
+def legacy_playcount_mapped(x, input_start, input_end, output_start=1, output_end=100):
+    if input_start == input_end:
+        return output_end
+
+    return (x - input_start) / (input_end - input_start) * (
+        output_end - output_start
+    ) + output_start
+
+
+def legacy_aggregate(top_lists: list[list[dict]], limit=100):
+    """The implementation fm server topartists used before the aggregation engine"""
+    contributors = 0
+    artist_map = {}
+    for artists in top_lists:
+        if len(artists) == 0:
+            continue
+
+        contributors += 1
+
+        lowest_playcount = int(artists[-1]["playcount"])
+        highest_playcount = int(artists[0]["playcount"])
+        for artist in artists:
+            playcount = int(artist["playcount"])
+            score = legacy_playcount_mapped(
+                playcount,
+                input_start=lowest_playcount,
+                input_end=highest_playcount,
+            )
+
+            name = artist["name"]
+
+            try:
+                artist_map[name]["score"] += score
+                artist_map[name]["playcount"] += playcount
+            except KeyError:
+                artist_map[name] = {"score": score, "playcount": playcount}
+
+    top = sorted(artist_map.items(), key=lambda x: x[1]["score"], reverse=True)
+    return top[:limit], contributors
+
+
+def generate_top_lists(members: int, per_member: int, artist_pool: int):
+    rng = random.Random(1)
+    top_lists = []
+    for _ in range(members):
+        names = rng.sample(range(artist_pool), per_member)
+        playcounts = sorted((rng.randint(1, 5000) for _ in names), reverse=True)
+        top_lists.append(
+            [
+                {"name": f"artist {name}", "playcount": str(playcount)}
+                for name, playcount in zip(names, playcounts)
+            ]
+        )
+    return top_lists
+
+
+def main():
+    members = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_member = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    top_lists = generate_top_lists(members, per_member, artist_pool=members * 10)
+
+    legacy_rows, legacy_contributors = legacy_aggregate(top_lists)
+    aggregate = aggregate_top_lists(top_lists, lambda artist: artist["name"])
+    assert legacy_contributors == aggregate.contributors
+    assert [name for name, _ in legacy_rows] == [row.name for row in aggregate.rows]
+
+    rounds = 5
+    legacy_time = timeit(lambda: legacy_aggregate(top_lists), number=rounds) / rounds
+    engine_time = (
+        timeit(
+            lambda: aggregate_top_lists(top_lists, lambda artist: artist["name"]),
+            number=rounds,
+        )
+        / rounds
+    )
+
+    print(f"{members} members x {per_member} artists")
+    print(f"legacy: {legacy_time * 1000:.1f} ms")
+    print(f"engine: {engine_time * 1000:.1f} ms ({legacy_time / engine_time:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
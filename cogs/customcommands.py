@@ -3,8 +3,9 @@
 # https://git.joinemm.dev/miso-bot
 
 import asyncio
-import io
 import json
+import tempfile
+from collections import OrderedDict
 
 import arrow
 import discord
@@ -19,9 +20,51 @@ from modules.ui import RowPaginator
 class CustomCommands(commands.Cog, name="Commands"):
     """Custom server commands"""
 
+    # guilds whose custom commands are kept in memory
+    MAX_INDEXED_GUILDS = 2000
+    # rows written or read per database round trip when importing or exporting
+    BULK_CHUNK_SIZE = 500
+
     def __init__(self, bot):
         self.bot: MisoBot = bot
         self.icon = "📌"
+        # guild_id -> lowercase trigger -> (trigger, content), least recently used first
+        self.trigger_index: OrderedDict[int, dict[str, tuple[str, str]]] = OrderedDict()
+
+    async def guild_triggers(self, guild_id: int) -> dict[str, tuple[str, str]]:
+        """Custom commands of a guild, loaded from the database on first use"""
+        triggers = self.trigger_index.get(guild_id)
+        if triggers is not None:
+            self.trigger_index.move_to_end(guild_id)
+            return triggers
+
+        data = await self.bot.db.fetch(
+            "SELECT command_trigger, content FROM custom_command WHERE guild_id = %s",
+            guild_id,
+        )
+        # triggers are matched case insensitively like the column collation does
+        triggers = {
+            trigger.lower(): (trigger, content) for trigger, content in data or []
+        }
+        self.trigger_index[guild_id] = triggers
+        while len(self.trigger_index) > self.MAX_INDEXED_GUILDS:
+            self.trigger_index.popitem(last=False)
+
+        return triggers
+
+    def index_add(self, guild_id: int, trigger: str, content: str):
+        # guilds that aren't loaded yet will read the new command from the database
+        if (triggers := self.trigger_index.get(guild_id)) is not None:
+            triggers[trigger.lower()] = (trigger, content)
+
+    def index_remove(self, guild_id: int, trigger: str):
+        if (triggers := self.trigger_index.get(guild_id)) is not None:
+            triggers.pop(trigger.lower(), None)
+
+    async def custom_command(self, guild_id: int, trigger: str) -> str | None:
+        """Get the response of a custom command, if it exists"""
+        command = (await self.guild_triggers(guild_id)).get(trigger.lower())
+        return command[1] if command else None
 
     def bot_command_list(self, match=""):
         """Returns list of bot commands"""
@@ -55,12 +98,9 @@ class CustomCommands(commands.Cog, name="Commands"):
 
     async def custom_command_list(self, guild_id, match=""):
         """Returns a list of custom commands on server"""
-        data = await self.bot.db.fetch_flattened(
-            "SELECT command_trigger FROM custom_command WHERE guild_id = %s", guild_id
-        )
         return {
             command_trigger
-            for command_trigger in data
+            for command_trigger, _ in (await self.guild_triggers(guild_id)).values()
             if match == "" or match in command_trigger
         }
 
@@ -74,11 +114,7 @@ class CustomCommands(commands.Cog, name="Commands"):
         error = getattr(error, "original", error)
         if isinstance(error, commands.CommandNotFound):
             keyword = ctx.message.content[len(ctx.prefix or "") :].split(" ", 1)[0]
-            response = await self.bot.db.fetch_value(
-                "SELECT content FROM custom_command WHERE guild_id = %s AND command_trigger = %s",
-                ctx.guild.id,
-                keyword,
-            )
+            response = await self.custom_command(ctx.guild.id, keyword)
             if response:
                 logger.info(util.log_command_format(ctx, extra="(CUSTOM)"))
                 await ctx.send(response)
@@ -123,11 +159,7 @@ class CustomCommands(commands.Cog, name="Commands"):
             raise exceptions.CommandWarning(
                 f"`{ctx.prefix}{name}` is already a built in command!"
             )
-        if await self.bot.db.fetch_value(
-            "SELECT content FROM custom_command WHERE guild_id = %s AND command_trigger = %s",
-            ctx.guild.id,
-            name,
-        ):
+        if await self.custom_command(ctx.guild.id, name):
             raise exceptions.CommandWarning(
                 f"Custom command `{ctx.prefix}{name}` already exists on this server!"
             )
@@ -140,6 +172,7 @@ class CustomCommands(commands.Cog, name="Commands"):
             arrow.utcnow().datetime,
             ctx.author.id,
         )
+        self.index_add(ctx.guild.id, name, response)
         await util.send_success(
             ctx,
             f"Custom command `{ctx.prefix}{name}` added with the response \n```{response}```",
@@ -183,6 +216,7 @@ class CustomCommands(commands.Cog, name="Commands"):
             ctx.guild.id,
             name,
         )
+        self.index_remove(ctx.guild.id, name)
         await util.send_success(
             ctx, f"Custom command `{ctx.prefix}{name}` has been deleted"
         )
@@ -253,85 +287,141 @@ class CustomCommands(commands.Cog, name="Commands"):
             )
 
         jsonfile = ctx.message.attachments[0]
-        imported = json.loads(await jsonfile.read())
-        tasks = []
-        for command in imported:
-            tasks.append(self.import_command(ctx, command))
+        try:
+            imported = json.loads(await jsonfile.read())
+        except json.JSONDecodeError as e:
+            raise exceptions.CommandWarning(f"Invalid json file: `{e}`")
+
+        if not isinstance(imported, list):
+            raise exceptions.CommandWarning(
+                "The json file must contain a list of commands"
+            )
 
         load = await ctx.send(emojis.LOADING)
-        results = await asyncio.gather(*tasks)
+        rows, successful, failed = await self.validate_import(ctx, imported)
+        for i in range(0, len(rows), self.BULK_CHUNK_SIZE):
+            await self.bot.db.executemany(
+                "INSERT INTO custom_command VALUES(%s, %s, %s, %s, %s)",
+                rows[i : i + self.BULK_CHUNK_SIZE],
+            )
+        for guild_id, name, text, _, _ in rows:
+            self.index_add(guild_id, name, text)
+
         await load.delete()
         await util.send_tasks_result_list(
             ctx,
-            successful_operations=[r[1] for r in filter(lambda x: x[0], results)],
-            failed_operations=[r[1] for r in filter(lambda x: not x[0], results)],
+            successful_operations=successful,
+            failed_operations=failed,
         )
 
+    async def validate_import(self, ctx: commands.Context, imported: list):
+        """Check every imported command in memory against the existing ones.
+        Returns the rows to insert and the result messages.
+        """
+        if ctx.guild is None:
+            raise exceptions.CommandError("Unable to get current guild")
+
+        builtin_commands = self.bot_command_list()
+        existing = await self.guild_triggers(ctx.guild.id)
+        seen = set()
+        rows = []
+        successful = []
+        failed = []
+        for command in imported:
+            try:
+                name = command["command"]
+                text = command["text"]
+                owner_id = int(command.get("owner", ctx.author.id))
+                added_on = arrow.get(
+                    command.get("added_on", arrow.utcnow().int_timestamp)
+                ).datetime
+            except (TypeError, KeyError, ValueError, arrow.ParserError):
+                failed.append(f"Invalid command `{command}`")
+                continue
+
+            if not isinstance(name, str) or not isinstance(text, str):
+                failed.append(f"Invalid command `{command}`")
+                continue
+
+            if name in builtin_commands:
+                failed.append(f"`{ctx.prefix}{name}` is already a built in command!")
+            elif name.lower() in existing or name.lower() in seen:
+                failed.append(
+                    f"Custom command `{ctx.prefix}{name}` already exists on this server!"
+                )
+            else:
+                seen.add(name.lower())
+                rows.append((ctx.guild.id, name, text, added_on, owner_id))
+                successful.append(name)
+
+        return rows, successful, failed
+
     @command.command(name="export")
     @commands.has_permissions(manage_guild=True)
     async def command_export(self, ctx: commands.Context):
         """Exports all custom commands in json format"""
         if ctx.guild is None:
             raise exceptions.CommandError("Unable to get current guild")
-        data = await self.bot.db.fetch(
-            """
-            SELECT command_trigger, content, added_by, added_on
-            FROM custom_command WHERE guild_id = %s
-            """,
-            ctx.guild.id,
-        )
-        if not data:
-            raise exceptions.CommandInfo(
-                "No custom commands have been added on this server yet"
-            )
 
-        jsondata = [
-            {
-                "command": trigger,
-                "text": content,
-                "owner": added_by,
-                "timestamp": int(added_on.timestamp()),
-            }
-            for (trigger, content, added_by, added_on) in data
-        ]
-        buffer = json.dumps(jsondata, indent=4).encode("utf-8")
-        await ctx.send(
-            file=discord.File(
-                fp=io.BytesIO(buffer),
-                filename=f"{ctx.guild} commands.json",
+        # small exports stay in memory, big ones are spooled to disk
+        with tempfile.SpooledTemporaryFile(max_size=2**20) as buffer:
+            count = 0
+            async for trigger, content, added_by, added_on in self.iter_guild_commands(
+                ctx.guild.id
+            ):
+                entry = json.dumps(
+                    {
+                        "command": trigger,
+                        "text": content,
+                        "owner": added_by,
+                        "timestamp": int(added_on.timestamp()),
+                    },
+                    indent=4,
+                )
+                # written piece by piece, the result is the same as dumping a list with indent=4
+                buffer.write(b",\n    " if count else b"[\n    ")
+                buffer.write(entry.replace("\n", "\n    ").encode())
+                count += 1
+
+            if count == 0:
+                raise exceptions.CommandInfo(
+                    "No custom commands have been added on this server yet"
+                )
+
+            buffer.write(b"\n]")
+            buffer.seek(0)
+            await ctx.send(
+                file=discord.File(
+                    fp=buffer,  # type: ignore
+                    filename=f"{ctx.guild} commands.json",
+                )
             )
-        )
 
-    async def import_command(self, ctx: commands.Context, command: dict):
-        if ctx.guild is None:
-            raise exceptions.CommandError("Unable to get current guild")
+    async def iter_guild_commands(self, guild_id: int):
+        """Read all custom commands of a guild in chunks, ordered by trigger"""
+        last_trigger = ""
+        while True:
+            data = await self.bot.db.fetch(
+                """
+                SELECT command_trigger, content, added_by, added_on
+                FROM custom_command WHERE guild_id = %s AND command_trigger > %s
+                ORDER BY command_trigger
+                LIMIT %s
+                """,
+                guild_id,
+                last_trigger,
+                self.BULK_CHUNK_SIZE,
+            )
+            if not data:
+                return
 
-        name = command["command"]
-        text = command["text"]
-        owner_id = command.get("owner", ctx.author.id)
-        added_on = command.get("added_on", arrow.utcnow().int_timestamp)
+            for row in data:
+                yield row
 
-        if name in self.bot_command_list():
-            return False, f"`{ctx.prefix}{name}` is already a built in command!"
-        if await self.bot.db.fetch_value(
-            "SELECT content FROM custom_command WHERE guild_id = %s AND command_trigger = %s",
-            ctx.guild.id,
-            name,
-        ):
-            return (
-                False,
-                f"Custom command `{ctx.prefix}{name}` already exists on this server!",
-            )
+            if len(data) < self.BULK_CHUNK_SIZE:
+                return
 
-        await self.bot.db.execute(
-            "INSERT INTO custom_command VALUES(%s, %s, %s, %s, %s)",
-            ctx.guild.id,
-            name,
-            text,
-            arrow.get(added_on).datetime,
-            owner_id,
-        )
-        return True, name
+            last_trigger = data[-1][0]
 
     @command.command(name="restrict")
     @commands.has_permissions(manage_guild=True)
@@ -383,6 +473,7 @@ class CustomCommands(commands.Cog, name="Commands"):
                 "DELETE FROM custom_command WHERE guild_id = %s",
                 guild.id,
             )
+            self.trigger_index[guild.id] = {}
             content.title = f":white_check_mark: Cleared commands in {guild}"
             content.description = ""
             content.color = int("77b255", 16)
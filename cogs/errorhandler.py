@@ -10,6 +10,7 @@ from discord.ext import commands
 from loguru import logger
 
 from modules import emojis, exceptions, queries, util
+from modules.circuit_breaker import CircuitOpen
 from modules.instagram import InstagramError
 from modules.misobot import MisoBot
 from modules.tiktok import TiktokError
@@ -283,6 +284,9 @@ class ErrorHandler(commands.Cog):
             case InstagramError():
                 await self.send_warning(ctx, error.message)
 
+            case CircuitOpen():
+                await self.send_warning(ctx, error.message)
+
             case exceptions.AgeRestricted():
                 logger.warning(self.log_format(ctx, error, error.message))
                 await self.send_embed(ctx, error.message, ":underage:", "DD2E44")
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: MPL-2.0
 # https://git.joinemm.dev/miso-bot
 
+import asyncio
 import random
 from itertools import cycle
 
@@ -11,12 +12,19 @@ from discord.ext import commands, tasks
 from loguru import logger
 
 from modules import emoji_literals, exceptions, queries, util
-from modules.misobot import MisoBot
+from modules.misobot import MessageStage, MisoBot, MisoContext
 
 
 class Events(commands.Cog):
     """Event handlers for various discord events"""
 
+    # member log entries arriving within this many seconds are sent together
+    MEMBER_LOG_WINDOW = 3
+    MEMBER_LOG_ROWS_PER_EMBED = 25
+    # discord limits a message to 10 embeds and 6000 characters across all of them
+    MEMBER_LOG_EMBEDS_PER_MESSAGE = 10
+    MEMBER_LOG_MESSAGE_CHARS = 6000
+
     def __init__(self, bot):
         self.bot: MisoBot = bot
         self.statuses = cycle(
@@ -27,12 +35,20 @@ class Events(commands.Cog):
         )
         self.activity_id = {"playing": 0, "streaming": 1, "listening": 2, "watching": 3}
         self.guildlog = 652916681299066900
+        # guild_id -> members waiting for their autoroles
+        self.join_queues: dict[int, asyncio.Queue] = {}
+        # log channel id -> (member, joined) waiting to be logged
+        self.member_log_batches: dict[int, list[tuple[discord.Member, bool]]] = {}
 
     async def cog_load(self):
         self.status_loop.start()
+        self.bot.add_message_stage(
+            MessageStage("autoresponses", self.autoresponse_stage, skip_commands=True)
+        )
 
     async def cog_unload(self):
         self.status_loop.cancel()
+        self.bot.remove_message_stage("autoresponses")
 
     @tasks.loop(minutes=3.0)
     async def status_loop(self):
@@ -122,54 +138,136 @@ class Events(commands.Cog):
         except discord.HTTPException:
             logger.error("Cannot send message to guild log channel")
 
+    def queue_autoroles(self, member: discord.Member, role_ids: tuple[int, ...]):
+        """Joins are processed one at a time per guild to smooth out raids"""
+        queue = self.join_queues.get(member.guild.id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.join_queues[member.guild.id] = queue
+            asyncio.ensure_future(self.join_queue_worker(member.guild.id, queue))
+
+        queue.put_nowait((member, role_ids))
+
+    async def join_queue_worker(self, guild_id: int, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                member, role_ids = queue.get_nowait()
+                # one role the bot can't give would fail the whole request
+                roles = [
+                    role
+                    for role in map(member.guild.get_role, role_ids)
+                    if role is not None and role.is_assignable()
+                ]
+                if not roles:
+                    continue
+
+                try:
+                    # non atomic sets all the roles with a single request
+                    await member.add_roles(*roles, reason="Autorole", atomic=False)
+                except discord.HTTPException:
+                    # still give every role that can be given
+                    for role in roles:
+                        try:
+                            await member.add_roles(role, reason="Autorole")
+                        except discord.errors.Forbidden:
+                            pass
+                        except discord.HTTPException as e:
+                            logger.warning(
+                                f"Failed to add autorole {role} to {member}: {e}"
+                            )
+        finally:
+            del self.join_queues[guild_id]
+
+    def queue_member_log(
+        self, channel: discord.abc.GuildChannel, member: discord.Member, joined: bool
+    ):
+        batch = self.member_log_batches.get(channel.id)
+        if batch is None:
+            batch = []
+            self.member_log_batches[channel.id] = batch
+            asyncio.ensure_future(self.send_member_log(channel))
+
+        batch.append((member, joined))
+
+    async def send_member_log(self, channel):
+        """Send the batched member log entries, a single entry is sent as it always was"""
+        await asyncio.sleep(self.MEMBER_LOG_WINDOW)
+        batch = self.member_log_batches.pop(channel.id, [])
+        if not batch:
+            return
+
+        if len(batch) == 1:
+            member, joined = batch[0]
+            embed = discord.Embed(
+                color=discord.Color.green() if joined else discord.Color.red()
+            )
+            embed.set_author(name=str(member), icon_url=member.display_avatar.url)
+            embeds = [embed]
+        else:
+            joins = sum(joined for _, joined in batch)
+            leaves = len(batch) - joins
+            if not leaves:
+                color = discord.Color.green()
+            elif not joins:
+                color = discord.Color.red()
+            else:
+                color = discord.Color.orange()
+
+            rows = [
+                f"{':inbox_tray:' if joined else ':outbox_tray:'} {member.mention} **{member}**"
+                for member, joined in batch
+            ]
+            embeds = [
+                discord.Embed(
+                    color=color,
+                    description="\n".join(rows[i : i + self.MEMBER_LOG_ROWS_PER_EMBED]),
+                )
+                for i in range(0, len(rows), self.MEMBER_LOG_ROWS_PER_EMBED)
+            ]
+            embeds[0].title = f"{joins} members joined, {leaves} members left"
+
+        messages: list[list[discord.Embed]] = [[]]
+        size = 0
+        for embed in embeds:
+            if messages[-1] and (
+                len(messages[-1]) >= self.MEMBER_LOG_EMBEDS_PER_MESSAGE
+                or size + len(embed) > self.MEMBER_LOG_MESSAGE_CHARS
+            ):
+                messages.append([])
+                size = 0
+            messages[-1].append(embed)
+            size += len(embed)
+
+        for message_embeds in messages:
+            try:
+                await channel.send(embeds=message_embeds)
+            except discord.errors.Forbidden:
+                return
+            except discord.errors.HTTPException as e:
+                logger.warning(f"Failed to send member log to {channel.id}: {e}")
+
     @commands.Cog.listener()
     async def on_member_join(self, member):
         """Called when a new member joins a guild"""
         await self.bot.wait_until_ready()
-        logging_channel_id = None
-        if logging_settings := self.bot.cache.logging_settings.get(
-            str(member.guild.id)
-        ):
-            logging_channel_id = logging_settings.get("member_log_channel_id")
-
-        if logging_channel_id:
-            logging_channel = member.guild.get_channel(logging_channel_id)
+        settings = await self.bot.cache.guild_settings(member.guild.id)
+        if settings.member_log_channel_id:
+            logging_channel = member.guild.get_channel(settings.member_log_channel_id)
             if logging_channel is not None:
-                embed = discord.Embed(color=discord.Color.green())
-                embed.set_author(name=str(member), icon_url=member.display_avatar.url)
-                try:
-                    await logging_channel.send(embed=embed)
-                except discord.errors.Forbidden:
-                    pass
+                self.queue_member_log(logging_channel, member, joined=True)
 
-        # add autoroles
-        roles = self.bot.cache.autoroles.get(str(member.guild.id), [])
-        for role_id in roles:
-            role = member.guild.get_role(role_id)
-            if role is None:
-                continue
-            try:
-                await member.add_roles(role)
-            except discord.errors.Forbidden:
-                pass
+        if settings.autoroles:
+            self.queue_autoroles(member, settings.autoroles)
 
         # welcome message
-        greeter = await self.bot.db.fetch_row(
-            """
-            SELECT channel_id, is_enabled, message_format
-            FROM greeter_settings WHERE guild_id = %s
-            """,
-            member.guild.id,
-        )
-        if greeter:
-            channel_id, is_enabled, message_format = greeter
-            if is_enabled:
-                greeter_channel = member.guild.get_channel(channel_id)
+        if greeter := settings.greeter:
+            if greeter.is_enabled:
+                greeter_channel = member.guild.get_channel(greeter.channel_id)
                 if greeter_channel is not None:
                     try:
                         await greeter_channel.send(
                             embed=util.create_welcome_embed(
-                                member, member.guild, message_format
+                                member, member.guild, greeter.message_format
                             )
                         )
                     except discord.errors.Forbidden:
@@ -179,12 +277,9 @@ class Events(commands.Cog):
     async def on_member_ban(self, guild, user):
         """Called when user gets banned from a server"""
         await self.bot.wait_until_ready()
-        logging_channel_id = None
-        if logging_settings := self.bot.cache.logging_settings.get(str(guild.id)):
-            logging_channel_id = logging_settings.get("ban_log_channel_id")
-
-        if logging_channel_id:
-            channel = guild.get_channel(logging_channel_id)
+        settings = await self.bot.cache.guild_settings(guild.id)
+        if settings.ban_log_channel_id:
+            channel = guild.get_channel(settings.ban_log_channel_id)
             if channel is not None:
                 try:
                     await channel.send(
@@ -201,35 +296,18 @@ class Events(commands.Cog):
     async def on_member_remove(self, member):
         """Called when member leaves a guild"""
         await self.bot.wait_until_ready()
-        logging_channel_id = None
-        if logging_settings := self.bot.cache.logging_settings.get(
-            str(member.guild.id)
-        ):
-            logging_channel_id = logging_settings.get("member_log_channel_id")
-
-        if logging_channel_id:
-            logging_channel = member.guild.get_channel(logging_channel_id)
+        settings = await self.bot.cache.guild_settings(member.guild.id)
+        if settings.member_log_channel_id:
+            logging_channel = member.guild.get_channel(settings.member_log_channel_id)
             if logging_channel is not None:
-                embed = discord.Embed(color=discord.Color.red())
-                embed.set_author(name=str(member), icon_url=member.display_avatar.url)
-                try:
-                    await logging_channel.send(embed=embed)
-                except discord.errors.Forbidden:
-                    pass
+                self.queue_member_log(logging_channel, member, joined=False)
 
         # goodbye message
-        goodbye = await self.bot.db.fetch_row(
-            """
-            SELECT channel_id, is_enabled, message_format
-                FROM goodbye_settings WHERE guild_id = %s
-            """,
-            member.guild.id,
-        )
-        if goodbye:
-            channel_id, is_enabled, message_format = goodbye
-            if is_enabled:
-                channel = member.guild.get_channel(channel_id)
+        if goodbye := settings.goodbye:
+            if goodbye.is_enabled:
+                channel = member.guild.get_channel(goodbye.channel_id)
                 if channel is not None:
+                    message_format = goodbye.message_format
                     if message_format is None:
                         message_format = "Goodbye **{user}** {mention}"
 
@@ -267,49 +345,22 @@ class Events(commands.Cog):
         if len(message.content) == 0 and len(message.attachments) == 0:
             return
 
-        channel_id = None
-        if logging_settings := self.bot.cache.logging_settings.get(
-            str(message.guild.id)
-        ):
-            channel_id = logging_settings.get("message_log_channel_id")
-        if channel_id:
-            log_channel = message.guild.get_channel(channel_id)
+        settings = await self.bot.cache.guild_settings(message.guild.id)
+        if settings.message_log_channel_id:
+            log_channel = message.guild.get_channel(settings.message_log_channel_id)
             if log_channel is not None and message.channel != log_channel:
-                # ignored channels
-                ignored_channels = await self.bot.db.fetch_flattened(
-                    "SELECT channel_id FROM message_log_ignore WHERE guild_id = %s",
-                    message.guild.id,
-                )
-                if message.channel.id not in ignored_channels:
+                if message.channel.id not in settings.message_log_ignored:
                     try:
                         await log_channel.send(embed=util.message_embed(message))
                     except discord.errors.Forbidden:
                         pass
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        """Listener that gets called on every message"""
-        await self.bot.wait_until_ready()
-
-        # ignore DMs
-        if message.guild is None:
-            return
-
-        # if bot account, ignore everything after this
-        if message.author.bot:
-            return
-
-        ctx = await self.bot.get_context(message)
-        if ctx.valid:
-            # a command will be run
-            return
-
-
-
-        if self.bot.cache.autoresponse.get(str(message.guild.id), True):
+    async def autoresponse_stage(self, message: discord.Message, _ctx: MisoContext):
+        """Message stage for guild messages that are not commands"""
+        settings = await self.bot.cache.guild_settings(message.guild.id)
+        if settings.autoresponses:
             await self.easter_eggs(message)
 
-
     @staticmethod
     async def easter_eggs(message: discord.Message):
         """Easter eggs handler"""
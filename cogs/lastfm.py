@@ -11,18 +11,30 @@ import sys
 import urllib.parse
 from dataclasses import dataclass
 from enum import Enum, auto
-from typing import TYPE_CHECKING, Annotated, Any, Callable, Literal, Optional, Union
+from time import time
+from typing import (
+    TYPE_CHECKING,
+    Annotated,
+    Any,
+    Awaitable,
+    Callable,
+    Literal,
+    Optional,
+    Union,
+)
 
 import aiohttp
 import arrow
 import discord
-import kdtree
 import orjson
 from discord.ext import commands, tasks
 from discord.utils import escape_markdown
 from loguru import logger
 
 from modules import emojis, exceptions, util
+from modules.aggregation import SCORING_MODES, Aggregate, aggregate_top_lists
+from modules.color_search import ColorIndex
+from modules.hotcache import NOT_CACHED, HotCache
 from modules.lastfm import LastFmApi, LastFmImage, Period
 from modules.misobot import LastFmContext, MisoBot, MisoContext
 from modules.ui import RowPaginator
@@ -49,24 +61,6 @@ def is_small_server():
     return commands.check(predicate)
 
 
-class AlbumColorNode:
-    def __init__(self, rgb, image_url):
-        self.rgb = rgb
-        self.data = image_url
-
-    def __len__(self):
-        return len(self.rgb)
-
-    def __getitem__(self, i):
-        return self.rgb[i]
-
-    def __str__(self):
-        return f"rgb{self.rgb}"
-
-    def __repr__(self):
-        return f"AlbumColorNode({self.rgb}, {self.data})"
-
-
 class PeriodArgument(commands.Converter):
     @staticmethod
     async def convert(_ctx: MisoContext, argument: str):
@@ -258,10 +252,33 @@ class LastFm(commands.Cog):
     LASTFM_RED = "e31c23"
     LASTFM_ICON_URL = "https://i.imgur.com/dMeDkPH.jpg"
 
+    # seconds a member's top list is reused before fetching it again
+    MEMBER_TOP_LIFETIME = {
+        Period.WEEK: 3600,
+        Period.MONTH: 3 * 3600,
+    }
+    MEMBER_TOP_LIFETIME_DEFAULT = 12 * 3600
+
+    # cached server top lists are rebuilt in the background once older than this
+    SERVER_TOP_REFRESH_INTERVAL = 30 * 60
+    SERVER_TOP_LIFETIME = 24 * 3600
+    # only keep refreshing server top lists someone has asked for recently
+    SERVER_TOP_ACTIVE_WINDOW = 6 * 3600
+    SERVER_TOP_REFRESHES_PER_RUN = 10
+
     def __init__(self, bot):
         self.icon = "🎵"
         self.bot: MisoBot = bot
         self.api = LastFmApi(bot)
+        self.image_color_cache = HotCache(
+            bot.redis,
+            "lastfm-image-color",
+            maxsize=20000,
+            lifetime=7 * 86400,
+            negative_lifetime=3600,
+        )
+        # (guild_id, period, kind) -> timestamp of the latest request, oldest first
+        self.server_top_requests: dict[tuple[int, Period, str], float] = {}
 
     @tasks.loop(minutes=1)
     async def lastfm_login_task(self):
@@ -280,11 +297,69 @@ class LastFm(commands.Cog):
             self.lastfm_login_task.cancel()
             logger.info("Lastfm login successfull, canceling task")
 
+    @tasks.loop(minutes=5)
+    async def server_top_refresh_task(self):
+        """Rebuild stale server top lists, most recently requested first"""
+        now = time()
+        self.prune_server_top_requests(now)
+        refreshed = 0
+        for guild_id, timeframe, kind in sorted(
+            self.server_top_requests,
+            key=self.server_top_requests.__getitem__,
+            reverse=True,
+        ):
+            if refreshed >= self.SERVER_TOP_REFRESHES_PER_RUN:
+                break
+
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+
+            server_top = await self.cached_server_top(guild, kind, timeframe)
+            if (
+                server_top is not None
+                and now - server_top["updated_at"] < self.SERVER_TOP_REFRESH_INTERVAL
+            ):
+                continue
+
+            try:
+                await self.refresh_server_top(guild, kind, timeframe)
+            except Exception as e:
+                logger.warning(
+                    f"Failed to refresh server top {kind} of {guild_id}: {e}"
+                )
+            refreshed += 1
+
+        if refreshed:
+            logger.info(f"Refreshed {refreshed} server top lists")
+
+    def note_server_top_request(self, request: tuple[int, Period, str]):
+        now = time()
+        # moved to the end to keep the dict ordered by request time
+        self.server_top_requests.pop(request, None)
+        self.server_top_requests[request] = now
+        self.prune_server_top_requests(now)
+
+    def prune_server_top_requests(self, now: float):
+        """Forget requests outside the active window, even without redis to refresh them"""
+        while self.server_top_requests:
+            oldest = next(iter(self.server_top_requests))
+            if now - self.server_top_requests[oldest] <= self.SERVER_TOP_ACTIVE_WINDOW:
+                break
+            del self.server_top_requests[oldest]
+
+    @server_top_refresh_task.before_loop
+    async def before_server_top_refresh(self):
+        await self.bot.wait_until_ready()
+
     async def cog_load(self):
         self.lastfm_login_task.start()
+        if self.bot.redis.enabled:
+            self.server_top_refresh_task.start()
 
     async def cog_unload(self):
         self.lastfm_login_task.cancel()
+        self.server_top_refresh_task.cancel()
 
     @commands.group(aliases=["lastfm", "lfm", "lf"])
     async def fm(self, ctx: MisoContext):
@@ -464,9 +539,10 @@ class LastFm(commands.Cog):
                 "Please give a number between 1 and your total amount of listened tracks."
             )
         PER_PAGE = 100
+        # only the total is needed here, so don't pull a whole page for it
         pre_data = await self.api.user_get_recent_tracks(
             ctx.lfm.username,
-            limit=PER_PAGE,
+            limit=1,
         )
 
         total = int(pre_data["@attr"]["total"])
@@ -478,7 +554,7 @@ class LastFm(commands.Cog):
 
         n_display = util.ordinal(n)
         remainder = total % PER_PAGE
-        total_pages = int(pre_data["@attr"]["totalPages"])
+        total_pages = math.ceil(total / PER_PAGE)
         if n > remainder:
             n = n - remainder
             containing_page = total_pages - math.ceil(n / PER_PAGE)
@@ -929,7 +1005,8 @@ class LastFm(commands.Cog):
         if not row_items:
             return raise_no_artist_plays(artist, timeframe)
 
-        row_items += await self.api.get_additional_library_pages(soup, url)
+        async for page_items in self.api.iter_additional_library_pages(soup, url):
+            row_items += page_items
 
         img_tag = soup.select_one(".chartlist-image .cover-art img")
         image = LastFmImage.from_url(img_tag.attrs["src"]) if img_tag else None
@@ -1189,8 +1266,14 @@ class LastFm(commands.Cog):
 
         elif "recent" in args or "recents" in args:
             chart_title = "recent tracks"
-            data = await self.api.user_get_recent_tracks(ctx.lfm.username, size.count)
-            for i, track in enumerate(data["track"]):
+            # only the scrobbled tracks, the currently playing one is not charted
+            tracks = [
+                track
+                async for track in self.api.iter_recent_tracks(
+                    ctx.lfm.username, limit=size.count
+                )
+            ]
+            for i, track in enumerate(tracks):
                 name = track["name"]
                 artist = track["artist"]["#text"]
                 chart_nodes.append(
@@ -1281,73 +1364,38 @@ class LastFm(commands.Cog):
 
         chart_nodes = []
 
-        data = await self.get_all_albums(ctx.lfm.username)
         albums = []
-        for a in data:
+        async for a in self.api.iter_top_albums(
+            ctx.lfm.username, Period.OVERALL, limit=1000
+        ):
             img = LastFmImage.from_url(a["image"][-1]["#text"])
             if img.is_missing():
                 continue
             albums.append(img)
 
-        to_fetch = []
-        albumcolors = await self.bot.db.fetch(
-            """
-            SELECT image_hash, r, g, b FROM image_color_cache WHERE image_hash IN %s
-            """,
-            tuple(a.hash for a in albums),
-        )
-
-        albumcolors_dict = {}
-        if albumcolors:
-            for image_hash, r, g, b in albumcolors:
-                albumcolors_dict[image_hash] = (r, g, b)
-
-        album_color_nodes = []
         warn = None
-        for image in albums:
-            color = albumcolors_dict.get(image.hash)
-            if color is None:
-                to_fetch.append(image)
-            else:
-                album_color_nodes.append(AlbumColorNode(color, image.hash))
 
-        if to_fetch:
-            to_cache = []
-
-            async def get_color(image):
-                color, hex_color = await self.get_hex(image)
-                if color is None:
-                    return None
-
-                return image.hash, color.r, color.g, color.b, hex_color
-
-            futures = [get_color(image) for image in to_fetch]
-            if len(futures) > 500:
+        async def warn_if_slow(uncached: int):
+            nonlocal warn
+            if uncached > 500:
                 warn = await ctx.send(
                     ":exclamation:Your library includes over 500 uncached album colours, "
                     f"this might take a while {emojis.LOADING}"
                 )
 
-            colordata = await asyncio.gather(*futures)
-            for colortuple in colordata:
-                if colortuple is None:
-                    continue
-                image_hash, r, g, b, hexcolor = colortuple
-                to_cache.append((image_hash, r, g, b, hexcolor))
-                album_color_nodes.append(AlbumColorNode((r, g, b), image_hash))
-
-            await self.bot.db.executemany(
-                """
-                INSERT IGNORE image_color_cache (image_hash, r, g, b, hex)
-                VALUES (%s, %s, %s, %s, %s)
-                """,
-                to_cache,
-            )
+        colors = await self.image_colors(albums, on_compute=warn_if_slow)
+        albumcolors_dict = {
+            image_hash: ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+            for image_hash, color in colors.items()
+            if color is not None
+        }
 
-        if not album_color_nodes:
+        if not albumcolors_dict:
             raise exceptions.CommandError("Failed at getting album data")
 
-        tree = kdtree.create(point_list=album_color_nodes)
+        color_index = ColorIndex(
+            list(albumcolors_dict.keys()), list(albumcolors_dict.values())
+        )
         if rainbow:
             rainbow_colors = (
                 [
@@ -1375,10 +1423,7 @@ class LastFm(commands.Cog):
                     (148, 0, 211),  # violet
                 ]
             )
-            chunks = [
-                list(tree.search_knn(rgb, size.width + size.height))
-                for rgb in rainbow_colors
-            ]
+            chunks = color_index.nearest_for_palette(rainbow_colors, size.height)
             random_offset = random.randint(0, 6)
             for album_index in range(size.count):
                 if diagonal:
@@ -1391,23 +1436,23 @@ class LastFm(commands.Cog):
                     choice_index = album_index % size.width
 
                 choose_from = chunks[choice_index]
-                choice = choose_from[album_index // size.height]
+                choice = choose_from[(album_index // size.height) % len(choose_from)]
 
                 chart_nodes.append(
                     (
-                        LastFmImage(choice[0].data.data),
+                        LastFmImage(choice),
                         "",
                     )
                 )
 
         else:
-            nearest = tree.search_knn(query_color.to_rgb(), size.count)
+            nearest = color_index.nearest(query_color.to_rgb(), size.count)
             chart_nodes = [
                 (
-                    LastFmImage(a[0].data.data),
+                    LastFmImage(image_hash),
                     "",
                 )
-                for a in nearest
+                for image_hash in nearest
             ]
 
         buffer = await self.chart_factory(
@@ -1641,210 +1686,224 @@ class LastFm(commands.Cog):
 
         await RowPaginator(content, rows).run(ctx)
 
-    @server.command(
-        name="topartists", aliases=["ta"], usage="[timeframe] ['score' | 'scrobble']"
-    )
-    async def server_topartists(
-        self,
-        ctx: MisoContext,
-        *args: Union[
-            Annotated[Period, PeriodArgument],
-            Annotated[str, ServerRankingArgument],
-        ],
-    ):
-        """Combined top artists of server members"""
-        timeframe = Period.OVERALL
-        mode = "score"
-        contributors = 0
+    def server_top_source(
+        self, kind: str
+    ) -> tuple[Callable, str, Callable[[dict], str]]:
+        """The api method, response key and grouping key of a server top list kind"""
+        match kind:
+            case "artists":
+                return self.api.user_get_top_artists, "artist", artist_name_key
+            case "tracks":
+                return self.api.user_get_top_tracks, "track", formatted_entry_key
+            case _:
+                return self.api.user_get_top_albums, "album", formatted_entry_key
 
-        for arg in args:
-            if isinstance(arg, Period):
-                timeframe = arg
-            else:
-                mode = arg
+    async def server_member_top_lists(
+        self,
+        guild: discord.Guild,
+        fetch: Callable,
+        data_key: str,
+        timeframe: Period,
+        fetch_limit: int = 100,
+    ) -> list[list[dict] | None] | None:
+        """Top lists of all linked server members, only fetching the ones that are stale"""
+        members = [
+            lastfm_username
+            for user_id, lastfm_username in await self.server_lastfm_usernames(guild)
+            if guild.get_member(user_id) is not None
+        ]
+        if not members:
+            return None
 
-        data = await self.task_for_each_server_member(
-            ctx.guild, self.api.user_get_top_artists, limit=100, period=timeframe
-        )
+        cache_keys = [
+            f"lastfm-member-top:{data_key}:{timeframe.value}:{fetch_limit}:{username}"
+            for username in members
+        ]
+        top_lists = [
+            None if cached is None else orjson.loads(cached)
+            for cached in await self.bot.redis.get_many(cache_keys)
+        ]
+        stale = [i for i, top_list in enumerate(top_lists) if top_list is None]
+        if not stale:
+            return top_lists
 
-        if data is None:
-            return await ctx.send(
-                "Nobody on this server has connected their Last.fm account yet!"
+        results = await asyncio.gather(
+            *(
+                task_wrapper(
+                    fetch(members[i], limit=fetch_limit, period=timeframe),
+                    i,
+                )
+                for i in stale
             )
-
-        artist_map = {}
-        for member_data, _member in data:
+        )
+        fetched = {}
+        for member_data, i in results:
             if member_data is None:
                 continue
 
-            artists = member_data["artist"]
-            if len(artists) == 0:
-                continue
-
-            contributors += 1
+            top_lists[i] = member_data[data_key]
+            fetched[cache_keys[i]] = orjson.dumps(top_lists[i])
 
-            lowest_playcount = int(artists[-1]["playcount"])
-            highest_playcount = int(artists[0]["playcount"])
-            for artist in artists:
-                playcount = int(artist["playcount"])
-                score = playcount_mapped(
-                    playcount,
-                    input_start=lowest_playcount,
-                    input_end=highest_playcount,
-                )
-
-                name = artist["name"]
+        await self.bot.redis.set_many(
+            fetched,
+            self.MEMBER_TOP_LIFETIME.get(timeframe, self.MEMBER_TOP_LIFETIME_DEFAULT),
+        )
+        return top_lists
 
-                try:
-                    artist_map[name]["score"] += score
-                    artist_map[name]["playcount"] += playcount
-                except KeyError:
-                    artist_map[name] = {"score": score, "playcount": playcount}
+    async def aggregate_server_top(
+        self,
+        guild: discord.Guild,
+        fetch: Callable,
+        data_key: str,
+        key: Callable[[dict], str],
+        timeframe: Period,
+        mode: str = "score",
+        limit: int = 100,
+        fetch_limit: int = 100,
+    ) -> Aggregate | None:
+        """Combined top list of all server members with a linked Last.fm account"""
+        top_lists = await self.server_member_top_lists(
+            guild, fetch, data_key, timeframe, fetch_limit
+        )
+        if top_lists is None:
+            return None
 
-        if mode == "score":
-            sort_key = "score"
-        else:
-            sort_key = "playcount"
+        return aggregate_top_lists(top_lists, key, mode=mode, limit=limit)
 
-        top_artists = sorted(
-            artist_map.items(), key=lambda x: x[1][sort_key], reverse=True
-        )[:100]
+    @staticmethod
+    def server_top_cache_key(guild: discord.Guild, kind: str, timeframe: Period):
+        return f"lastfm-server-top:{guild.id}:{timeframe.value}:{kind}"
 
-        if not top_artists:
-            return await ctx.send("Nobody on this server has listened to anything!")
+    async def cached_server_top(
+        self, guild: discord.Guild, kind: str, timeframe: Period
+    ) -> dict | None:
+        cached = await self.bot.redis.get(
+            self.server_top_cache_key(guild, kind, timeframe)
+        )
+        if cached is None:
+            return None
 
-        rows = []
-        for i, (artist, artist_data) in enumerate(top_artists, start=1):
-            if mode == "score":
-                rows.append(
-                    f"`#{i:2}` **{artist_data['score'] / contributors:.2f}%** /"
-                    f" **{artist_data['playcount']}** plays • **{artist}**"
-                )
-            else:
-                rows.append(
-                    f"`#{i:2}` **{artist_data['playcount']}** plays • **{artist}**"
-                )
+        return orjson.loads(cached)
 
-        if mode == "score":
-            footer = f"Score calculated from top 100 artists of {contributors} members"
-        else:
-            footer = (
-                f"Ranked by scrobbles from top 100 artists of {contributors} members"
-            )
+    async def refresh_server_top(
+        self, guild: discord.Guild, kind: str, timeframe: Period
+    ) -> dict | None:
+        """Rebuild and cache the server top list in every ranking mode"""
+        fetch, data_key, key = self.server_top_source(kind)
+        top_lists = await self.server_member_top_lists(
+            guild, fetch, data_key, timeframe
+        )
+        if top_lists is None:
+            return None
 
-        await self.paginated_user_stat_embed(
-            ctx,
-            rows,
-            f"Top 100 Artists ({timeframe.display()})",
-            image=await self.api.get_artist_image(top_artists[0][0]),
-            footer=footer,
-            server_target=True,
+        server_top = {
+            "updated_at": time(),
+            "modes": {
+                mode: aggregate_top_lists(top_lists, key, mode=mode).to_dict()
+                for mode in SCORING_MODES
+            },
+        }
+        await self.bot.redis.set(
+            self.server_top_cache_key(guild, kind, timeframe),
+            orjson.dumps(server_top),
+            self.SERVER_TOP_LIFETIME,
         )
+        return server_top
 
-    @server.command(
-        name="toptracks", aliases=["tt"], usage="[timeframe] ['score' | 'scrobble']"
-    )
-    async def server_toptracks(
-        self,
-        ctx: MisoContext,
-        *args: Union[
-            Annotated[Period, PeriodArgument],
-            Annotated[str, ServerRankingArgument],
-        ],
-    ):
-        """Combined top tracks of server members"""
+    async def send_server_top(self, ctx: MisoContext, args: tuple, kind: str):
+        """Shared implementation of the server top artists, albums and tracks"""
         timeframe = Period.OVERALL
         mode = "score"
-        contributors = 0
-
         for arg in args:
             if isinstance(arg, Period):
                 timeframe = arg
             else:
                 mode = arg
 
-        data = await self.task_for_each_server_member(
-            ctx.guild, self.api.user_get_top_tracks, limit=100, period=timeframe
-        )
+        self.note_server_top_request((ctx.guild.id, timeframe, kind))
+        server_top = await self.cached_server_top(ctx.guild, kind, timeframe)
+        if server_top is None:
+            server_top = await self.refresh_server_top(ctx.guild, kind, timeframe)
 
-        if data is None:
+        if server_top is None:
             return await ctx.send(
                 "Nobody on this server has connected their Last.fm account yet!"
             )
 
-        track_map = {}
-        for member_data, _member in data:
-            if member_data is None:
-                continue
+        aggregate = Aggregate.from_dict(server_top["modes"][mode])
 
-            tracks = member_data["track"]
-            if len(tracks) == 0:
-                continue
-
-            contributors += 1
-
-            lowest_playcount = int(tracks[-1]["playcount"])
-            highest_playcount = int(tracks[0]["playcount"])
-            for track in tracks:
-                playcount = int(track["playcount"])
-                score = playcount_mapped(
-                    playcount,
-                    input_start=lowest_playcount,
-                    input_end=highest_playcount,
-                )
-
-                name = (
-                    f"**{escape_markdown(track['artist']['name'])}** — "
-                    f"***{escape_markdown(track['name'])}***"
-                )
-                try:
-                    track_map[name]["score"] += score
-                    track_map[name]["playcount"] += playcount
-                except KeyError:
-                    track_map[name] = {
-                        "score": score,
-                        "playcount": playcount,
-                        "url": track["url"],
-                    }
-
-        if mode == "score":
-            sort_key = "score"
-        else:
-            sort_key = "playcount"
-
-        top_tracks = sorted(
-            track_map.items(), key=lambda x: x[1][sort_key], reverse=True
-        )[:100]
-
-        if not top_tracks:
+        if not aggregate.rows:
             return await ctx.send("Nobody on this server has listened to anything!")
 
         rows = []
-        for i, (track, track_data) in enumerate(top_tracks, start=1):
+        for i, row in enumerate(aggregate.rows, start=1):
+            name = f"**{row.name}**" if kind == "artists" else row.name
             if mode == "score":
                 rows.append(
-                    f"`#{i:2}` **{track_data['score'] / contributors:.2f}%** /"
-                    f" **{track_data['playcount']}** plays • {track}"
+                    f"`#{i:2}` **{aggregate.percentage(row):.2f}%** /"
+                    f" **{row.playcount}** plays • {name}"
                 )
             else:
-                rows.append(f"`#{i:2}` **{track_data['playcount']}** plays • {track}")
+                rows.append(f"`#{i:2}` **{row.playcount}** plays • {name}")
 
         if mode == "score":
-            footer = f"Score calculated from top 100 tracks of {contributors} members"
+            footer = (
+                f"Score calculated from top 100 {kind} "
+                f"of {aggregate.contributors} members"
+            )
         else:
             footer = (
-                f"Ranked by scrobbles from top 100 tracks of {contributors} members"
+                f"Ranked by scrobbles from top 100 {kind} "
+                f"of {aggregate.contributors} members"
             )
+        footer += f" • Updated {arrow.get(server_top['updated_at']).humanize()}"
+
+        top = aggregate.rows[0]
+        match kind:
+            case "artists":
+                image = await self.api.get_artist_image(top.name)
+            case "tracks":
+                image = await self.api.scrape_track_image(top.item["url"])
+            case _:
+                image = LastFmImage.from_url(top.item["image"][0]["#text"])
 
         await self.paginated_user_stat_embed(
             ctx,
             rows,
-            f"Top 100 Tracks ({timeframe.display()})",
-            image=await self.api.scrape_track_image(top_tracks[0][1]["url"]),
+            f"Top 100 {kind.capitalize()} ({timeframe.display()})",
+            image=image,
             footer=footer,
             server_target=True,
         )
 
+    @server.command(
+        name="topartists", aliases=["ta"], usage="[timeframe] ['score' | 'scrobble']"
+    )
+    async def server_topartists(
+        self,
+        ctx: MisoContext,
+        *args: Union[
+            Annotated[Period, PeriodArgument],
+            Annotated[str, ServerRankingArgument],
+        ],
+    ):
+        """Combined top artists of server members"""
+        await self.send_server_top(ctx, args, "artists")
+
+    @server.command(
+        name="toptracks", aliases=["tt"], usage="[timeframe] ['score' | 'scrobble']"
+    )
+    async def server_toptracks(
+        self,
+        ctx: MisoContext,
+        *args: Union[
+            Annotated[Period, PeriodArgument],
+            Annotated[str, ServerRankingArgument],
+        ],
+    ):
+        """Combined top tracks of server members"""
+        await self.send_server_top(ctx, args, "tracks")
+
     @server.command(
         name="topalbums", aliases=["talb"], usage="[timeframe] ['score' | 'scrobble']"
     )
@@ -1857,97 +1916,7 @@ class LastFm(commands.Cog):
         ],
     ):
         """Combined top albums of server members"""
-        timeframe = Period.OVERALL
-        mode = "score"
-        contributors = 0
-
-        for arg in args:
-            if isinstance(arg, Period):
-                timeframe = arg
-            else:
-                mode = arg
-
-        data = await self.task_for_each_server_member(
-            ctx.guild, self.api.user_get_top_albums, limit=100, period=timeframe
-        )
-
-        if data is None:
-            return await ctx.send(
-                "Nobody on this server has connected their Last.fm account yet!"
-            )
-
-        album_map = {}
-        for member_data, _member in data:
-            if member_data is None:
-                continue
-
-            albums = member_data["album"]
-            if len(albums) == 0:
-                continue
-
-            contributors += 1
-
-            lowest_playcount = int(albums[-1]["playcount"])
-            highest_playcount = int(albums[0]["playcount"])
-            for album in albums:
-                playcount = int(album["playcount"])
-                score = playcount_mapped(
-                    playcount,
-                    input_start=lowest_playcount,
-                    input_end=highest_playcount,
-                )
-
-                name = (
-                    f"**{escape_markdown(album['artist']['name'])}** — "
-                    f"***{escape_markdown(album['name'])}***"
-                )
-                try:
-                    album_map[name]["score"] += score
-                    album_map[name]["playcount"] += playcount
-                except KeyError:
-                    album_map[name] = {
-                        "score": score,
-                        "playcount": playcount,
-                        "image": album["image"][0]["#text"],
-                    }
-
-        if mode == "score":
-            sort_key = "score"
-        else:
-            sort_key = "playcount"
-
-        top_albums = sorted(
-            album_map.items(), key=lambda x: x[1][sort_key], reverse=True
-        )[:100]
-
-        if not top_albums:
-            return await ctx.send("Nobody on this server has listened to anything!")
-
-        rows = []
-        for i, (album, album_data) in enumerate(top_albums, start=1):
-            if mode == "score":
-                rows.append(
-                    f"`#{i:2}` **{album_data['score'] / contributors:.2f}%** /"
-                    f" **{album_data['playcount']}** plays • {album}"
-                )
-            else:
-                rows.append(f"`#{i:2}` **{album_data['playcount']}** plays • {album}")
-
-        if mode == "score":
-            footer = f"Score calculated from top 100 albums of {contributors} members"
-        else:
-            footer = (
-                f"Ranked by scrobbles from top 100 albums of {contributors} members"
-            )
-
-        await self.paginated_user_stat_embed(
-            ctx,
-            rows,
-            f"Top 100 Albums ({timeframe.display()})",
-            image=LastFmImage.from_url(top_albums[0][1]["image"]),
-            footer=footer,
-            server_target=True,
-        )
+        await self.send_server_top(ctx, args, "albums")
 
     @server.command(
         name="chart",
@@ -1977,7 +1946,6 @@ class LastFm(commands.Cog):
         """
         timeframe = Period.WEEK
         size = ChartSize(3, 3)
-        contributors = 0
 
         for arg in args:
             if isinstance(arg, Period):
@@ -1994,63 +1962,37 @@ class LastFm(commands.Cog):
         topster = "topster" in args
         if "artist" in args:
             chart_title = "top artist"
-            data = await self.task_for_each_server_member(
+            aggregate = await self.aggregate_server_top(
                 ctx.guild,
                 self.api.user_get_top_artists,
+                "artist",
+                artist_name_key,
+                timeframe,
                 limit=size.count,
-                period=timeframe,
+                fetch_limit=size.count,
             )
 
-            if data is None:
+            if aggregate is None:
                 return await ctx.send(
                     "Nobody on this server has connected their Last.fm account yet!"
                 )
 
-            artist_map = {}
-            for member_data, _member in data:
-                if member_data is None:
-                    continue
-
-                artists = member_data["artist"]
-                if len(artists) == 0:
-                    continue
-
-                contributors += 1
-
-                lowest_playcount = int(artists[-1]["playcount"])
-                highest_playcount = int(artists[0]["playcount"])
-                for artist in artists:
-                    playcount = int(artist["playcount"])
-                    score = playcount_mapped(
-                        playcount,
-                        input_start=lowest_playcount,
-                        input_end=highest_playcount,
-                    )
-
-                    name = artist["name"]
-
-                    try:
-                        artist_map[name]["score"] += score
-                        artist_map[name]["playcount"] += playcount
-                    except KeyError:
-                        artist_map[name] = {"score": score, "playcount": playcount}
-
-            top_artists = sorted(
-                artist_map.items(), key=lambda x: x[1]["score"], reverse=True
-            )[: size.count]
-
-            if not top_artists:
+            if not aggregate.rows:
                 return await ctx.send("Nobody on this server has listened to anything!")
 
-            for i, (name, artist_data) in enumerate(top_artists):
-                image = await self.api.get_artist_image(name)
+            images = await self.api.get_artist_images(
+                [row.name for row in aggregate.rows]
+            )
+            for i, row in enumerate(aggregate.rows):
+                name = row.name
+                image = images[name]
                 if image is None:
                     image = LastFmImage(LastFmImage.MISSING_IMAGE_HASH)
 
                 chart_nodes.append(
                     (
                         image,
-                        f"<p class='label'>{name}<p><p class='playcount'>{artist_data['score'] / contributors:.2f}%<p>",
+                        f"<p class='label'>{name}<p><p class='playcount'>{aggregate.percentage(row):.2f}%<p>",
                     )
                 )
                 if topster:
@@ -2108,59 +2050,29 @@ class LastFm(commands.Cog):
         else:
             chart_title = "top album"
 
-            data = await self.task_for_each_server_member(
-                ctx.guild, self.api.user_get_top_albums, limit=100, period=timeframe
+            aggregate = await self.aggregate_server_top(
+                ctx.guild,
+                self.api.user_get_top_albums,
+                "album",
+                lambda album: f"{album['artist']['name']} — {album['name']}",
+                timeframe,
+                limit=size.count,
             )
 
-            if data is None:
+            if aggregate is None:
                 return await ctx.send(
                     "Nobody on this server has connected their Last.fm account yet!"
                 )
 
-            album_map = {}
-            for member_data, _member in data:
-                if member_data is None:
-                    continue
-
-                albums = member_data["album"]
-                if len(albums) == 0:
-                    continue
-
-                contributors += 1
-
-                lowest_playcount = int(albums[-1]["playcount"])
-                highest_playcount = int(albums[0]["playcount"])
-                for album in albums:
-                    playcount = int(album["playcount"])
-                    score = playcount_mapped(
-                        playcount,
-                        input_start=lowest_playcount,
-                        input_end=highest_playcount,
-                    )
-
-                    name = f"{album['artist']['name']} — {album['name']}"
-                    try:
-                        album_map[name]["score"] += score
-                        album_map[name]["playcount"] += playcount
-                    except KeyError:
-                        album_map[name] = {
-                            "score": score,
-                            "playcount": playcount,
-                            "image": album["image"][0]["#text"],
-                        }
-
-            top_albums = sorted(
-                album_map.items(), key=lambda x: x[1]["score"], reverse=True
-            )[: size.count]
-
-            if not top_albums:
+            if not aggregate.rows:
                 return await ctx.send("Nobody on this server has listened to anything!")
 
-            for i, (name, album_data) in enumerate(top_albums):
+            for i, row in enumerate(aggregate.rows):
+                name = row.name
                 chart_nodes.append(
                     (
-                        LastFmImage.from_url(album_data["image"]),
-                        f"<p class='label'>{name}</p><p class='playcount'>{album_data['score'] / contributors:.2f}%</p>",
+                        LastFmImage.from_url(row.item["image"][0]["#text"]),
+                        f"<p class='label'>{name}</p><p class='playcount'>{aggregate.percentage(row):.2f}%</p>",
                     )
                 )
                 if topster:
@@ -2533,61 +2445,94 @@ class LastFm(commands.Cog):
 
         return content
 
-    async def get_hex(self, image: LastFmImage):
-        """Get the dominan color of lastfm image."""
-        color = await util.rgb_from_image_url(
-            self.bot.session,
-            image.as_64s(),
-        )
-        hex_color = util.rgb_to_hex(color) if color is not None else None
-        return color, hex_color
+    async def get_hex(
+        self, image: LastFmImage
+    ) -> tuple[util.Rgb | None, str | None] | None:
+        """Get the dominant color of lastfm image.
+        Returns (None, None) if the image has no usable color, and None if it couldn't be fetched.
+        """
+        try:
+            color = await util.rgb_from_image_url(
+                self.bot.session,
+                image.as_64s(),
+            )
+        except asyncio.TimeoutError:
+            return None
+        except (OSError, IndexError):
+            # not an image or no colors found in it
+            return None, None
 
-    async def image_color(self, image: LastFmImage) -> int | None:
-        """Get the dominant color of lastfm image, cache if new."""
-        cached_color = await self.bot.db.fetch_value(
-            "SELECT hex FROM image_color_cache WHERE image_hash = %s",
-            image.hash,
-        )
-        if cached_color:
-            return int(cached_color, 16)
+        if color is None:
+            return None
 
-        # color not cached yet, compute and store
+        return color, util.rgb_to_hex(color)
 
-        color, hex_color = await self.get_hex(image)
-        if color is None or hex_color is None:
-            return None
+    async def image_color(self, image: LastFmImage) -> int | None:
+        """Get the dominant color of lastfm image, cache if new."""
+        return (await self.image_colors([image]))[image.hash]
 
-        await self.bot.db.execute(
-            """
-            INSERT IGNORE image_color_cache (image_hash, r, g, b, hex)
-                VALUES (%s, %s, %s, %s, %s)
-            """,
-            image.hash,
-            color.r,
-            color.g,
-            color.b,
-            hex_color,
-        )
+    async def image_colors(
+        self,
+        images: list[LastFmImage],
+        on_compute: Callable[[int], Awaitable[Any]] | None = None,
+    ) -> dict[str, int | None]:
+        """Get the dominant colors of many lastfm images by hash, computing only uncached ones.
+        `on_compute` is awaited with the amount of colors that have to be computed.
+        """
+        colors = await self.image_color_cache.get_many(image.hash for image in images)
+        missing = [
+            image_hash
+            for image_hash, hex_color in colors.items()
+            if hex_color is NOT_CACHED
+        ]
 
-        return int(hex_color, 16)
+        if missing:
+            stored = dict(
+                await self.bot.db.fetch(
+                    "SELECT image_hash, hex FROM image_color_cache WHERE image_hash IN %s",
+                    missing,
+                )
+                or []
+            )
+            colors.update(stored)
+            await self.image_color_cache.set_many(stored)
+            missing = [image_hash for image_hash in missing if image_hash not in stored]
 
-    async def get_all_albums(self, username: str):
-        data = await self.api.user_get_top_albums(
-            username,
-            Period.OVERALL,
-            limit=500,
-        )
-        topalbums = data["album"]
-        total_pages = int(data["@attr"]["totalPages"])
+        if missing:
+            # color not cached yet, compute and store
+            if on_compute is not None:
+                await on_compute(len(missing))
 
-        # get additional page if exists for a total of 1000
-        if total_pages > 1:
-            data = await self.api.user_get_top_albums(
-                username, Period.OVERALL, limit=500, page=2
+            computed = await asyncio.gather(
+                *(self.get_hex(LastFmImage(image_hash)) for image_hash in missing)
             )
-            topalbums += data["album"]
+            to_cache = []
+            known = {}
+            for image_hash, result in zip(missing, computed):
+                if result is None:
+                    # fetching failed, try again next time instead of caching nothing
+                    colors[image_hash] = None
+                    continue
+
+                color, hex_color = result
+                colors[image_hash] = known[image_hash] = hex_color
+                if color is not None and hex_color is not None:
+                    to_cache.append((image_hash, color.r, color.g, color.b, hex_color))
+
+            await self.image_color_cache.set_many(known)
+            if to_cache:
+                await self.bot.db.executemany(
+                    """
+                    INSERT IGNORE image_color_cache (image_hash, r, g, b, hex)
+                        VALUES (%s, %s, %s, %s, %s)
+                    """,
+                    to_cache,
+                )
 
-        return topalbums
+        return {
+            image_hash: None if hex_color is None else int(hex_color, 16)
+            for image_hash, hex_color in colors.items()
+        }
 
 
 async def setup(bot):
@@ -2672,6 +2617,18 @@ async def task_wrapper(task: asyncio.Future, ref: Any):
     return result, ref
 
 
+def artist_name_key(artist: dict) -> str:
+    return artist["name"]
+
+
+def formatted_entry_key(entry: dict) -> str:
+    """Markdown formatted name of a track or album including the artist"""
+    return (
+        f"**{escape_markdown(entry['artist']['name'])}** — "
+        f"***{escape_markdown(entry['name'])}***"
+    )
+
+
 def filter_tags(tags: list[str]):
     """get rid of useless tags"""
     clean_tags = []
@@ -2684,21 +2641,3 @@ def filter_tags(tags: list[str]):
 
     return clean_tags
 
-
-def playcount_mapped(
-    x: int,
-    input_start: int,
-    input_end: int,
-    output_start: int = 1,
-    output_end: int = 100,
-):
-    # if everything has the same playcount, give max points
-    # or else we will run into ZeroDivisionError
-    if input_start == input_end:
-        return output_end
-
-    score = (x - input_start) / (input_end - input_start) * (
-        output_end - output_start
-    ) + output_start
-
-    return score
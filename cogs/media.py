@@ -5,6 +5,7 @@
 import random
 import re
 import urllib
+from functools import partial
 from typing import Literal
 
 import discord
@@ -14,22 +15,94 @@ from discord.ext import commands
 from loguru import logger
 
 from modules import emojis, exceptions, util
+from modules.embed_queue import EmbedQueue
 from modules.media_embedders import (
     BaseEmbedder,
     InstagramEmbedder,
+    Options,
     TikTokEmbedder,
     TwitterEmbedder,
+    scan_links,
 )
-from modules.misobot import MisoBot
+from modules.misobot import MessageStage, MisoBot, MisoContext
 from modules.ui import RowPaginator, TextPaginator
 
 
 class Media(commands.Cog):
     """Fetch various media"""
 
+    AUTO_EMBEDDERS: dict[str, type[InstagramEmbedder | TikTokEmbedder]] = {
+        "instagram": InstagramEmbedder,
+        "tiktok": TikTokEmbedder,
+    }
+
     def __init__(self, bot):
         self.bot: MisoBot = bot
         self.icon = "🖼️"
+        self.embed_queue = EmbedQueue(bot)
+
+    async def cog_load(self):
+        self.embed_queue.start()
+        self.bot.add_message_stage(
+            MessageStage("autoembed", self.autoembed_stage, skip_commands=True)
+        )
+
+    async def cog_unload(self):
+        self.bot.remove_message_stage("autoembed")
+        self.embed_queue.stop()
+
+    async def autoembed_stage(self, message: discord.Message, _ctx: MisoContext):
+        """Message stage that queues automatic embeds for supported links"""
+        settings = await self.bot.cache.guild_settings(message.guild.id)
+        if not settings.auto_embedders:
+            return
+
+        embedders: dict[str, BaseEmbedder] = {}
+        for provider, link in scan_links(message.content, strict=False):
+            embed_settings = settings.auto_embedders.get(provider)
+            if embed_settings is None:
+                continue
+
+            embedder = embedders.get(provider)
+            if embedder is None:
+                embedder = embedders[provider] = self.AUTO_EMBEDDERS[provider](self.bot)
+
+            await self.embed_queue.submit(
+                message.guild.id,
+                provider,
+                str(link),
+                partial(
+                    self.send_auto_embed,
+                    embedder,
+                    message,
+                    link,
+                    embedder.get_options(embed_settings.options),
+                    embed_settings.reply,
+                ),
+            )
+
+    @staticmethod
+    async def send_auto_embed(
+        embedder: BaseEmbedder,
+        message: discord.Message,
+        link,
+        options: Options,
+        reply: bool,
+    ):
+        if reply and not options.delete_after:
+            await embedder.send_reply(message, link, options)
+        else:
+            await embedder.send_contextless(
+                message.channel, message.author, link, options
+            )
+
+        if options.delete_after:
+            try:
+                await message.delete()
+            except (discord.errors.NotFound, discord.errors.Forbidden):
+                pass
+        else:
+            await util.suppress(message)
 
     @commands.command(aliases=["yt"])
     async def youtube(self, ctx: commands.Context, *, query):
@@ -128,7 +201,7 @@ class Media(commands.Cog):
             not data,
         )
 
-        await self.bot.cache.cache_auto_embedders()
+        self.bot.cache.invalidate_guild_settings(ctx.guild.id)
 
         await util.send_success(
             ctx,
@@ -157,6 +230,7 @@ class Media(commands.Cog):
             options,
             options,
         )
+        self.bot.cache.invalidate_guild_settings(ctx.guild.id)
 
         await util.send_success(
             ctx,
@@ -181,6 +255,7 @@ class Media(commands.Cog):
             on_or_off,
             on_or_off,
         )
+        self.bot.cache.invalidate_guild_settings(ctx.guild.id)
 
         await util.send_success(
             ctx,
@@ -3,6 +3,8 @@
 # https://git.joinemm.dev/miso-bot
 
 import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
 from typing import Optional
 
 import discord
@@ -11,24 +13,156 @@ from discord.ext import commands
 from loguru import logger
 
 from modules import emojis, exceptions, queries, util
-from modules.misobot import MisoBot
+from modules.member_resolver import MemberResolver
+from modules.misobot import MessageStage, MisoBot, MisoContext
 from modules.ui import RowPaginator
 
+KEYWORD_REGEX = r"(?:^|\s|[\~\"\'\+\*\`\_\/])(\L<words>)(?:$|\W|\s|s)"
+
+
+def compile_keywords(keywords) -> regex.Pattern:
+    """Compile keywords into a single pattern.
+    The named list is matched as a set, so matching doesn't slow down with more keywords.
+    """
+    return regex.compile(KEYWORD_REGEX, words=keywords, flags=regex.IGNORECASE)
+
+
+def highlight_keywords(pattern: regex.Pattern, keywords, text: str) -> str:
+    # the pattern can be shared by the whole guild, only highlight the given words
+    return pattern.sub(
+        lambda x: (
+            f"**{x.group(0)}**"
+            if x.group(1).lower().strip() in keywords
+            else x.group(0)
+        ),
+        text,
+    )
+
+
+@dataclass
+class PendingNotification:
+    member: discord.Member
+    pattern: regex.Pattern
+    matches: list[tuple[discord.Message, set[str]]] = field(default_factory=list)
+    overflow: int = 0
+    # keywords of the overflowing matches, they still count as triggered
+    overflow_triggers: Counter[str] = field(default_factory=Counter)
+
 
 class Notifications(commands.Cog):
     """Set keyword notifications"""
 
+    # matches for the same recipient within this many seconds are sent as one DM
+    COALESCE_WINDOW = 5
+    # messages shown in one coalesced DM, the rest are only counted
+    MAX_COALESCED = 5
+    # recipients waiting for delivery before new ones are dropped
+    MAX_PENDING = 1000
+    DELIVERY_WORKERS = 4
+
     def __init__(self, bot):
         self.bot: MisoBot = bot
         self.icon = "📨"
-        self.keyword_regex = r"(?:^|\s|[\~\"\'\+\*\`\_\/])(\L<words>)(?:$|\W|\s|s)"
         self.notifications_cache: dict[int, dict[str, set]] = {}
+        # compiled lazily from notifications_cache, dropped whenever a guild's keywords change
+        self.keyword_matchers: dict[int, regex.Pattern] = {}
+        self.members = MemberResolver()
+        # (guild_id, user_id) -> matches waiting to be sent as one DM
+        self.pending_notifications: dict[tuple[int, int], PendingNotification] = {}
+        self.delivery_queue: asyncio.Queue[tuple[int, int]] = asyncio.Queue()
+        self.delivery_workers: list[asyncio.Task] = []
 
     async def cog_load(self):
         await self.create_cache()
+        self.bot.add_message_stage(
+            MessageStage("notifications", self.notification_stage)
+        )
+        self.delivery_workers = [
+            asyncio.create_task(self.delivery_worker())
+            for _ in range(self.DELIVERY_WORKERS)
+        ]
+
+    async def cog_unload(self):
+        self.bot.remove_message_stage("notifications")
+        for worker in self.delivery_workers:
+            worker.cancel()
+
+    def update_queue_metrics(self, dropped_reason: str | None = None):
+        if prom := self.bot.get_cog("Prometheus"):
+            prom.notification_queue_depth.set(len(self.pending_notifications))  # type: ignore
+            if dropped_reason is not None:
+                prom.notifications_dropped.labels(dropped_reason).inc()  # type: ignore
+
+    def enqueue_notification(
+        self,
+        member: discord.Member,
+        message: discord.Message,
+        keywords: set[str],
+        pattern: regex.Pattern,
+    ):
+        """Queue a notification, merging it into one already waiting for the same member"""
+        key = (member.guild.id, member.id)
+        pending = self.pending_notifications.get(key)
+        if pending is not None:
+            pending.pattern = pattern
+            if len(pending.matches) < self.MAX_COALESCED:
+                pending.matches.append((message, keywords))
+            else:
+                pending.overflow += 1
+                pending.overflow_triggers.update(keywords)
+            if prom := self.bot.get_cog("Prometheus"):
+                prom.notifications_coalesced.inc()  # type: ignore
+            return
+
+        if len(self.pending_notifications) >= self.MAX_PENDING:
+            logger.warning(
+                f"Notification queue full, dropping notification to {member}"
+            )
+            self.update_queue_metrics(dropped_reason="queue_full")
+            return
+
+        self.pending_notifications[key] = PendingNotification(
+            member, pattern, [(message, keywords)]
+        )
+        asyncio.get_running_loop().call_later(
+            self.COALESCE_WINDOW, self.delivery_queue.put_nowait, key
+        )
+        self.update_queue_metrics()
+
+    async def delivery_worker(self):
+        while True:
+            key = await self.delivery_queue.get()
+            pending = self.pending_notifications.pop(key, None)
+            self.update_queue_metrics()
+            if pending is None:
+                continue
+
+            try:
+                if len(pending.matches) == 1:
+                    message, keywords = pending.matches[0]
+                    await self.send_notification(
+                        pending.member, message, keywords, pattern=pending.pattern
+                    )
+                else:
+                    await self.send_notification_digest(pending)
+            except Exception as e:
+                logger.error(f"Failed to deliver notification to {pending.member}: {e}")
+
+    def keyword_matcher(self, guild_id: int) -> regex.Pattern | None:
+        matcher = self.keyword_matchers.get(guild_id)
+        if matcher is None:
+            keywords = self.notifications_cache.get(guild_id)
+            if not keywords:
+                return None
+
+            matcher = compile_keywords(keywords.keys())
+            self.keyword_matchers[guild_id] = matcher
+
+        return matcher
 
     async def create_cache(self):
         self.notifications_cache = {}
+        self.keyword_matchers = {}
         keywords = await self.bot.db.fetch(
             "SELECT guild_id, user_id, keyword FROM notification",
         )
@@ -36,20 +170,64 @@ class Notifications(commands.Cog):
             return
 
         for guild_id, user_id, keyword in keywords:
-            if self.notifications_cache.get(guild_id) is None:
-                self.notifications_cache[guild_id] = {}
+            self.cache_add(guild_id, user_id, keyword)
+
+    def cache_add(self, guild_id: int, user_id: int, keyword: str):
+        guild_keywords = self.notifications_cache.setdefault(guild_id, {})
+        if keyword not in guild_keywords:
+            guild_keywords[keyword] = set()
+            # matcher only needs rebuilding when the set of keywords changes
+            self.keyword_matchers.pop(guild_id, None)
+
+        guild_keywords[keyword].add(user_id)
+
+    def cache_remove(self, guild_id: int, user_id: int, keywords=None):
+        """Remove user's keywords from the cache, or all of them if no keywords are given"""
+        guild_keywords = self.notifications_cache.get(guild_id)
+        if guild_keywords is None:
+            return
+
+        if keywords is None:
+            keywords = list(guild_keywords)
+
+        for keyword in keywords:
+            users = guild_keywords.get(keyword)
+            if users is None:
+                continue
 
-            if self.notifications_cache[guild_id].get(keyword) is None:
-                self.notifications_cache[guild_id][keyword] = set()
+            users.discard(user_id)
+            if not users:
+                del guild_keywords[keyword]
+                self.keyword_matchers.pop(guild_id, None)
 
-            self.notifications_cache[guild_id][keyword].add(user_id)
+        if not guild_keywords:
+            del self.notifications_cache[guild_id]
+
+    async def delete_member_notifications(
+        self, guild_id: int, user_id: int, keywords: set[str]
+    ):
+        try:
+            await self.bot.db.execute(
+                """
+                DELETE FROM notification
+                    WHERE guild_id = %s
+                    AND user_id = %s
+                    AND keyword IN %s
+                """,
+                guild_id,
+                user_id,
+                keywords,
+            )
+        except Exception as e:
+            logger.error(f"Failed to delete notifications of {user_id}: {e}")
 
     async def send_notification(
         self,
         member: discord.User | discord.Member,
         message: discord.Message,
-        keywords: list[str],
+        keywords: list[str] | set[str],
         test=False,
+        pattern: regex.Pattern | None = None,
     ):
         if message.guild is None:
             return
@@ -58,12 +236,10 @@ class Notifications(commands.Cog):
         content.set_author(
             name=f"{message.author}", icon_url=message.author.display_avatar.url
         )
-        pattern = regex.compile(
-            self.keyword_regex, words=keywords, flags=regex.IGNORECASE
-        )
-        highlighted_text = regex.sub(
-            pattern, lambda x: f"**{x.group(0)}**", message.content
-        )
+        if pattern is None:
+            pattern = compile_keywords(keywords)
+
+        highlighted_text = highlight_keywords(pattern, keywords, message.content)
 
         content.description = highlighted_text[:2047]
         content.add_field(
@@ -93,29 +269,64 @@ class Notifications(commands.Cog):
         except discord.errors.Forbidden:
             logger.warning(f"Forbidden when trying to send a notification to {member}.")
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        """Notification message handler"""
-        await self.bot.wait_until_ready()
+    async def send_notification_digest(self, pending: PendingNotification):
+        """Send multiple matches for the same member as one DM"""
+        member = pending.member
+        guild = member.guild
+        last_message = pending.matches[-1][0]
+        total = len(pending.matches) + pending.overflow
 
-        # ignore DMs
-        if message.guild is None:
-            return
+        content = discord.Embed(color=last_message.author.color)
+        content.set_author(
+            name=f"{total} messages matched your keywords",
+            icon_url=getattr(guild.icon, "url", None),
+        )
+        rows = []
+        for message, keywords in pending.matches:
+            highlighted_text = highlight_keywords(
+                pending.pattern, keywords, message.content
+            )
+            rows.append(
+                f"**{message.author}** in {message.channel.mention}: "
+                f"{highlighted_text[:300]} [Jump]({message.jump_url})"
+            )
+        if pending.overflow:
+            rows.append(f"*...and {pending.overflow} more*")
 
-        # ignore bot messages
-        if message.author.bot:
-            return
+        content.description = "\n\n".join(rows)[:4096]
+        content.set_footer(text=f"{guild}", icon_url=getattr(guild.icon, "url", None))
+        content.timestamp = last_message.created_at
 
-        keywords = self.notifications_cache.get(message.guild.id)
-        if keywords is None:
-            return
-
-        pattern = regex.compile(
-            self.keyword_regex,
-            words=keywords.keys(),
-            flags=regex.IGNORECASE,
+        triggers = (
+            Counter(keyword for _, keywords in pending.matches for keyword in keywords)
+            + pending.overflow_triggers
         )
+        try:
+            await member.send(embed=content)
+            logger.info(
+                f"Sending {total} coalesced notifications for words {set(triggers)} to {member}"
+            )
+            await self.bot.db.executemany(
+                """
+                UPDATE notification
+                    SET times_triggered = times_triggered + %s
+                WHERE guild_id = %s AND user_id = %s AND keyword = %s
+                """,
+                [
+                    (count, guild.id, member.id, keyword)
+                    for keyword, count in triggers.items()
+                ],
+            )
+        except discord.errors.Forbidden:
+            logger.warning(f"Forbidden when trying to send a notification to {member}.")
 
+    async def notification_stage(self, message: discord.Message, _ctx: MisoContext):
+        """Notification message handler"""
+        pattern = self.keyword_matcher(message.guild.id)
+        if pattern is None:
+            return
+
+        keywords = self.notifications_cache[message.guild.id]
         finds = pattern.findall(message.content)
         if not finds:
             return
@@ -133,33 +344,26 @@ class Notifications(commands.Cog):
 
                 users_keywords[user_id].add(keyword)
 
-        for user_id, users_words in users_keywords.items():
-            try:
-                member = await message.guild.fetch_member(user_id)
-            except discord.NotFound:
-                logger.warning(
-                    f"User {user_id} not found, deleting their notification for {users_words}"
-                )
-                await self.bot.db.execute(
-                    """
-                    DELETE FROM notification
-                        WHERE guild_id = %s
-                        AND user_id = %s
-                        AND keyword IN %s
-                    """,
-                    message.guild.id,
-                    user_id,
-                    users_words,
-                )
-                await self.create_cache()
-                continue
+        if not users_keywords:
+            return
 
-            if (
-                member is not None
-                and message.channel.permissions_for(member).read_messages
-            ):
-                asyncio.ensure_future(
-                    self.send_notification(member, message, users_words)
+        members, not_in_guild = await self.members.resolve(
+            message.guild, users_keywords.keys()
+        )
+        for user_id in not_in_guild:
+            users_words = users_keywords[user_id]
+            logger.warning(
+                f"User {user_id} not found, deleting their notification for {users_words}"
+            )
+            self.cache_remove(message.guild.id, user_id, users_words)
+            asyncio.ensure_future(
+                self.delete_member_notifications(message.guild.id, user_id, users_words)
+            )
+
+        for user_id, member in members.items():
+            if message.channel.permissions_for(member).read_messages:
+                self.enqueue_notification(
+                    member, message, users_keywords[user_id], pattern
                 )
 
     @commands.group(case_insensitive=True, aliases=["noti", "notif", "notifications"])
@@ -175,8 +379,6 @@ class Notifications(commands.Cog):
                 "Global notifications have been removed for performance reasons."
             )
 
-
-
         try:
             await ctx.message.delete()
         except (discord.Forbidden, discord.NotFound):
@@ -215,8 +417,7 @@ class Notifications(commands.Cog):
             keyword,
         )
 
-        # remake notification cache
-        await self.create_cache()
+        self.cache_add(guild_id, ctx.author.id, keyword)
         await util.send_success(
             ctx, f"New notification set! Check your DM {emojis.VIVISMIRK}"
         )
@@ -267,8 +468,7 @@ class Notifications(commands.Cog):
             keyword,
         )
 
-        # remake notification cache
-        await self.create_cache()
+        self.cache_remove(guild_id, ctx.author.id, [keyword])
         await util.send_success(
             ctx, f"Removed a notification! Check your DM {emojis.VIVISMIRK}"
         )
@@ -329,6 +529,8 @@ class Notifications(commands.Cog):
                 """,
                 ctx.author.id,
             )
+            for guild_id in list(self.notifications_cache):
+                self.cache_remove(guild_id, ctx.author.id)
             await util.send_success(
                 ctx, "Cleared all of your notifications in all servers!"
             )
@@ -340,13 +542,11 @@ class Notifications(commands.Cog):
                 ctx.author.id,
                 ctx.guild.id,
             )
+            self.cache_remove(ctx.guild.id, ctx.author.id)
             await util.send_success(
                 ctx, "Cleared all of your notifications in this server!"
             )
 
-        # remake notification cache
-        await self.create_cache()
-
     @notification.command(name="test")
     async def notification_test(
         self, ctx: commands.Context, message: Optional[discord.Message] = None
@@ -377,13 +577,12 @@ class Notifications(commands.Cog):
                 ctx.author.id,
             )
 
-            pattern = regex.compile(
-                self.keyword_regex, words=keywords, flags=regex.IGNORECASE
-            )
-
+            pattern = compile_keywords(keywords)
             if finds := pattern.findall(message.content):
-                keywords = list(set(finds))
-                await self.send_notification(ctx.author, message, keywords, test=True)
+                keywords = {find.lower().strip() for find in finds}
+                await self.send_notification(
+                    ctx.author, message, keywords, test=True, pattern=pattern
+                )
                 await ctx.send(":ok_hand: Check your DM")
             else:
                 await ctx.send(":x: This message would not notify you")
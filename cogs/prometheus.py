@@ -5,7 +5,7 @@
 import statistics
 
 from discord.ext import commands, tasks
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 from modules.misobot import MisoBot
 
@@ -56,6 +56,44 @@ class Prometheus(commands.Cog):
             "Aiohttp clientsession total requests per domain.",
             ["host", "status_code"],
         )
+        self.notification_queue_depth = Gauge(
+            "miso_notification_queue_depth",
+            "Recipients waiting for a keyword notification DM.",
+        )
+        self.notifications_coalesced = Counter(
+            "miso_notifications_coalesced",
+            "Keyword matches merged into an already queued notification.",
+        )
+        self.notifications_dropped = Counter(
+            "miso_notifications_dropped",
+            "Keyword notifications dropped before delivery.",
+            ["reason"],
+        )
+        self.circuit_state = Gauge(
+            "miso_circuit_state",
+            "State of a provider's circuit breaker (0 closed, 1 half open, 2 open).",
+            ["circuit"],
+        )
+        self.circuit_calls = Counter(
+            "miso_circuit_calls",
+            "Calls through a circuit breaker by outcome.",
+            ["circuit", "outcome"],
+        )
+        self.embed_queue_depth = Gauge(
+            "miso_embed_queue_depth",
+            "Automatic embeds waiting for a worker.",
+        )
+        self.embed_queue_wait = Histogram(
+            "miso_embed_queue_wait_seconds",
+            "Time automatic embeds spent queued before a worker picked them up.",
+            ["provider"],
+            buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+        )
+        self.embed_jobs_dropped = Counter(
+            "miso_embed_jobs_dropped",
+            "Automatic embeds that were not queued.",
+            ["reason"],
+        )
 
     async def cog_load(self):
         self.log_shard_latencies.start()
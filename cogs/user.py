@@ -9,10 +9,12 @@ import arrow
 import bleach
 import discord
 import humanize
-from discord.ext import commands
+from discord.ext import commands, tasks
+from loguru import logger
 
 from modules import emojis, exceptions, queries, util
-from modules.misobot import MisoBot
+from modules.activity import ActivityEngine
+from modules.misobot import MessageStage, MisoBot, MisoContext
 from modules.ui import RowPaginator
 
 
@@ -26,6 +28,38 @@ class User(commands.Cog):
         self.medal_emoji = [":first_place:", ":second_place:", ":third_place:"]
         with open("html/profile.min.html", "r", encoding="utf-8") as file:
             self.profile_html = file.read()
+        self.activity = ActivityEngine(bot)
+
+    async def cog_load(self):
+        self.activity_flush_loop.start()
+        self.bot.add_message_stage(MessageStage("activity", self.activity_stage))
+
+    async def cog_unload(self):
+        self.bot.remove_message_stage("activity")
+        self.activity_flush_loop.cancel()
+        await self.activity.flush()
+
+    @tasks.loop(seconds=60)
+    async def activity_flush_loop(self):
+        try:
+            await self.activity.flush()
+        except Exception as e:
+            logger.error(f"Activity flush failed: {e}")
+
+    async def activity_stage(self, message: discord.Message, _ctx: MisoContext):
+        """Message stage that gives xp for every message"""
+        new_level = self.activity.add_message(message)
+        if new_level is None:
+            return
+
+        settings = await self.bot.cache.guild_settings(message.guild.id)
+        if settings.levelup_messages:
+            try:
+                await message.channel.send(
+                    f"{message.author.mention} just leveled up! (level **{new_level}**)"
+                )
+            except discord.errors.Forbidden:
+                pass
 
     @commands.command(aliases=["dp", "av", "pfp"])
     async def avatar(
@@ -510,8 +544,12 @@ class User(commands.Cog):
             "DISCRIMINATOR": f"#{user.discriminator}",
             "DESCRIPTION": description,
     
-            "SERVER_LEVEL": 0,
-            "GLOBAL_LEVEL": 0,
+            "SERVER_LEVEL": util.get_level(
+                await self.activity.server_xp(ctx.guild.id, user.id)
+            )
+            if ctx.guild is not None
+            else 0,
+            "GLOBAL_LEVEL": util.get_level(await self.activity.global_xp(user.id)),
             "ACTIVITY_DATA": [],
             "CHART_MAX": 0,
             "COMMANDS_USED": command_uses or 0,
@@ -0,0 +1,152 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+import discord
+from loguru import logger
+
+from modules import util
+
+if TYPE_CHECKING:
+    from modules.misobot import MisoBot
+
+# xp is stored per hour of the day (UTC)
+HOUR_COLUMNS = [f"h{hour}" for hour in range(24)]
+TOTAL_XP = " + ".join(HOUR_COLUMNS)
+
+
+class ActivityEngine:
+    """Accumulates message xp in memory and writes it to the database in bulk"""
+
+    def __init__(self, bot: "MisoBot"):
+        self.bot = bot
+        # (guild_id, user_id, hour) -> [xp, message count] not yet in the database
+        self.pending: dict[tuple[int, int, int], list[int]] = {}
+        # (guild_id, user_id) -> total xp including pending, kept for recently active users
+        self.totals: dict[tuple[int, int], int] = {}
+
+    def add_message(self, message: discord.Message) -> int | None:
+        """Record the xp of a message, returns the new level if the author leveled up"""
+        if message.guild is None:
+            return None
+
+        xp = util.xp_from_message(message)
+        key = (message.guild.id, message.author.id, message.created_at.hour)
+        if (entry := self.pending.get(key)) is not None:
+            entry[0] += xp
+            entry[1] += 1
+        else:
+            self.pending[key] = [xp, 1]
+
+        # level ups can only be detected once the total has been loaded by a flush
+        user_key = key[:2]
+        total = self.totals.get(user_key)
+        if total is None:
+            return None
+
+        self.totals[user_key] = total + xp
+        new_level = util.get_level(total + xp)
+        if new_level > util.get_level(total):
+            return new_level
+
+        return None
+
+    def pending_xp(self, guild_id: int | None, user_id: int) -> list[int]:
+        """Unflushed xp of the user per hour, from every guild if guild_id is None"""
+        hours = [0] * 24
+        for (pending_guild_id, pending_user_id, hour), (xp, _) in self.pending.items():
+            if pending_user_id == user_id and guild_id in (None, pending_guild_id):
+                hours[hour] += xp
+        return hours
+
+    async def hourly_xp(self, guild_id: int, user_id: int) -> list[int]:
+        row = await self.bot.db.fetch_row(
+            f"SELECT {', '.join(HOUR_COLUMNS)} FROM user_activity "
+            "WHERE guild_id = %s AND user_id = %s",
+            guild_id,
+            user_id,
+        )
+        stored = row or [0] * 24
+        return [int(a) + b for a, b in zip(stored, self.pending_xp(guild_id, user_id))]
+
+    async def server_xp(self, guild_id: int, user_id: int) -> int:
+        return sum(await self.hourly_xp(guild_id, user_id))
+
+    async def global_xp(self, user_id: int) -> int:
+        stored = await self.bot.db.fetch_value(
+            f"SELECT SUM({TOTAL_XP}) FROM user_activity WHERE user_id = %s",
+            user_id,
+        )
+        return int(stored or 0) + sum(self.pending_xp(None, user_id))
+
+    async def flush(self):
+        """Write all pending xp with one bulk upsert per hour column"""
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        by_hour = defaultdict(list)
+        for (guild_id, user_id, hour), (xp, messages) in pending.items():
+            by_hour[hour].append((guild_id, user_id, xp, messages))
+
+        for hour, rows in by_hour.items():
+            column = HOUR_COLUMNS[hour]
+            try:
+                await self.bot.db.executemany(
+                    f"""
+                    INSERT INTO user_activity (guild_id, user_id, {column}, message_count)
+                        VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        {column} = {column} + VALUES({column}),
+                        message_count = message_count + VALUES(message_count)
+                    """,
+                    rows,
+                )
+            except Exception as e:
+                logger.error(f"Failed to flush activity for hour {hour}: {e}")
+                # put it back to be retried on the next flush
+                for guild_id, user_id, xp, messages in rows:
+                    entry = self.pending.setdefault((guild_id, user_id, hour), [0, 0])
+                    entry[0] += xp
+                    entry[1] += messages
+
+        await self.load_totals(
+            {(guild_id, user_id) for guild_id, user_id, _ in pending}
+        )
+
+    async def load_totals(self, active: set[tuple[int, int]]):
+        """Keep totals of users active since the last flush, loading the ones not known yet"""
+        unknown_keys = active - self.totals.keys()
+        unknown = defaultdict(list)
+        for guild_id, user_id in unknown_keys:
+            unknown[guild_id].append(user_id)
+
+        stored = {}
+        for guild_id, user_ids in unknown.items():
+            for user_id, total in (
+                await self.bot.db.fetch(
+                    f"""
+                    SELECT user_id, {TOTAL_XP} FROM user_activity
+                    WHERE guild_id = %s AND user_id IN %s
+                    """,
+                    guild_id,
+                    user_ids,
+                )
+                or []
+            ):
+                stored[(guild_id, user_id)] = int(total)
+
+        # known totals were kept up to date by add_message during the queries,
+        # but xp gained meanwhile by the newly loaded users is only in pending
+        totals = {key: total for key, total in self.totals.items() if key in active}
+        for key in unknown_keys:
+            totals[key] = stored.get(key, 0)
+
+        for (guild_id, user_id, _), (xp, _) in self.pending.items():
+            if (guild_id, user_id) in unknown_keys:
+                totals[(guild_id, user_id)] += xp
+
+        self.totals = totals
@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterable
+
+import numpy as np
+
+SCORE_MIN = 1
+SCORE_MAX = 100
+
+
+def mapped_score(
+    playcounts: np.ndarray, lowest: np.ndarray, highest: np.ndarray
+) -> np.ndarray:
+    """Map every playcount into 1-100 relative to the member's own top list"""
+    spread = highest - lowest
+    scaled = (playcounts - lowest) / np.where(spread == 0, 1, spread)
+    # if everything has the same playcount, give max points
+    return np.where(
+        spread == 0,
+        SCORE_MAX,
+        scaled * (SCORE_MAX - SCORE_MIN) + SCORE_MIN,
+    )
+
+
+def scrobble_score(
+    playcounts: np.ndarray, _lowest: np.ndarray, _highest: np.ndarray
+) -> np.ndarray:
+    """Rank purely by the amount of scrobbles"""
+    return playcounts.astype(np.float64)
+
+
+# ranking mode -> function returning the ranking value of every row
+SCORING_MODES: dict[str, Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]] = {
+    "score": mapped_score,
+    "scrobble": scrobble_score,
+}
+
+
+@dataclass
+class AggregateRow:
+    name: str
+    score: float
+    playcount: int
+    item: dict
+
+
+@dataclass
+class Aggregate:
+    rows: list[AggregateRow]
+    contributors: int
+
+    def percentage(self, row: AggregateRow) -> float:
+        return row.score / self.contributors
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": [asdict(row) for row in self.rows],
+            "contributors": self.contributors,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Aggregate":
+        return cls(
+            rows=[AggregateRow(**row) for row in data["rows"]],
+            contributors=data["contributors"],
+        )
+
+
+def aggregate_top_lists(
+    top_lists: Iterable[list[dict] | None],
+    key: Callable[[dict], str],
+    mode: str = "score",
+    limit: int = 100,
+) -> Aggregate:
+    """Combine the top lists of many users into one ranked list.
+
+    Every list is expected to be sorted by playcount, highest first, like Last.fm returns them.
+    Rows are grouped by the name returned from `key`, ties keep the order of first appearance.
+    """
+    items: list[dict] = []
+    names: list[str] = []
+    starts: list[int] = []
+    for top_list in top_lists:
+        if not top_list:
+            continue
+
+        starts.append(len(items))
+        items += top_list
+        names += map(key, top_list)
+
+    if not items:
+        return Aggregate(rows=[], contributors=0)
+
+    playcount_array = np.array(
+        [int(item["playcount"]) for item in items], dtype=np.int64
+    )
+
+    # codes are handed out in order of first appearance, so ties can be broken by code
+    index: dict[str, int] = {}
+    codes = np.fromiter(
+        (index.setdefault(name, len(index)) for name in names),
+        dtype=np.intp,
+        count=len(names),
+    )
+    unique_names = list(index)
+    _, first_index = np.unique(codes, return_index=True)
+
+    # broadcast every member's highest and lowest playcount over their rows
+    start_array = np.asarray(starts, dtype=np.intp)
+    end_array = np.append(start_array[1:], len(items))
+    lengths = end_array - start_array
+    highest = np.repeat(playcount_array[start_array], lengths)
+    lowest = np.repeat(playcount_array[end_array - 1], lengths)
+
+    scores = mapped_score(playcount_array, lowest, highest)
+    if mode == "score":
+        ranking = scores
+    else:
+        ranking = SCORING_MODES[mode](playcount_array, lowest, highest)
+
+    group_count = len(unique_names)
+    score_totals = np.bincount(codes, weights=scores, minlength=group_count)
+    playcount_totals = np.bincount(
+        codes, weights=playcount_array, minlength=group_count
+    ).astype(np.int64)
+    ranking_totals = (
+        score_totals
+        if ranking is scores
+        else np.bincount(codes, weights=ranking, minlength=group_count)
+    )
+
+    # highest ranking first, earlier appearance wins ties
+    order = np.argsort(-ranking_totals, kind="stable")[:limit]
+    return Aggregate(
+        rows=[
+            AggregateRow(
+                name=unique_names[i],
+                score=float(score_totals[i]),
+                playcount=int(playcount_totals[i]),
+                item=items[int(first_index[i])],
+            )
+            for i in order.tolist()
+        ],
+        contributors=len(starts),
+    )
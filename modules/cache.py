@@ -2,6 +2,9 @@
 # SPDX-License-Identifier: MPL-2.0
 # https://git.joinemm.dev/miso-bot
 
+import asyncio
+from dataclasses import dataclass, field
+from time import monotonic
 from typing import TYPE_CHECKING
 
 from loguru import logger
@@ -10,28 +13,200 @@ if TYPE_CHECKING:
     from modules.misobot import MisoBot
 
 
+@dataclass
+class GreeterSettings:
+    channel_id: int
+    is_enabled: bool
+    message_format: str | None
+
+
+@dataclass
+class AutoEmbedSettings:
+    options: str
+    reply: bool
+
+
+# providers that have a column in media_auto_embed_enabled
+AUTO_EMBED_PROVIDERS = ("instagram", "tiktok")
+
+
+@dataclass
+class GuildSettings:
+    """Settings read by the event listeners, cached per guild"""
+
+    member_log_channel_id: int | None = None
+    ban_log_channel_id: int | None = None
+    message_log_channel_id: int | None = None
+    message_log_ignored: frozenset[int] = field(default_factory=frozenset)
+    greeter: GreeterSettings | None = None
+    goodbye: GreeterSettings | None = None
+    autoroles: tuple[int, ...] = ()
+    autoresponses: bool = True
+    levelup_messages: bool = False
+    # provider -> settings, only for the enabled auto embedders
+    auto_embedders: dict[str, AutoEmbedSettings] = field(default_factory=dict)
+
+
 class Cache:
+    # settings that could not be loaded completely are only kept this long
+    PARTIAL_SETTINGS_LIFETIME = 60
+
     def __init__(self, bot):
         self.bot: MisoBot = bot
         self.log_emoji = False
         self.prefixes = {}
         self.rolepickers = set()
-        self.autoresponse = {}
         self.blacklist = {}
         self.marriages = []
+        self.guild_settings_cache: dict[int, GuildSettings] = {}
+        # guild_id -> settings being loaded, so concurrent events share one load
+        self.guild_settings_loading: dict[int, asyncio.Task] = {}
+        # guild_id -> when partially loaded settings should be loaded again
+        self.guild_settings_retry: dict[int, float] = {}
 
+    async def guild_settings(self, guild_id: int) -> GuildSettings:
+        """Get settings of a guild, loading them from the database on first use"""
+        settings = self.guild_settings_cache.get(guild_id)
+        if settings is not None:
+            retry_at = self.guild_settings_retry.get(guild_id)
+            if retry_at is None or retry_at > monotonic():
+                return settings
+            self.invalidate_guild_settings(guild_id)
 
+        task = self.guild_settings_loading.get(guild_id)
+        if task is None:
+            task = asyncio.create_task(self.load_guild_settings(guild_id))
+            self.guild_settings_loading[guild_id] = task
 
-    async def initialize_settings_cache(self):
-        logger.info("Caching settings...")
+        try:
+            settings, complete = await asyncio.shield(task)
+        except Exception as e:
+            logger.error(f"Failed to load settings of guild {guild_id}: {e}")
+            settings, complete = GuildSettings(), False
+
+        # a load that was invalidated while running is not cached
+        if self.guild_settings_loading.get(guild_id) is task:
+            del self.guild_settings_loading[guild_id]
+            self.guild_settings_cache[guild_id] = settings
+            if not complete:
+                self.guild_settings_retry[guild_id] = (
+                    monotonic() + self.PARTIAL_SETTINGS_LIFETIME
+                )
+
+        return settings
+
+    def invalidate_guild_settings(self, guild_id: int):
+        """Call after changing any setting of GuildSettings, next access will reload it"""
+        self.guild_settings_cache.pop(guild_id, None)
+        self.guild_settings_loading.pop(guild_id, None)
+        self.guild_settings_retry.pop(guild_id, None)
 
+    async def load_guild_settings(self, guild_id: int) -> tuple[GuildSettings, bool]:
+        """Load every section on its own, a section that fails keeps its defaults.
 
-        guild_settings = await self.bot.db.fetch(
-            "SELECT guild_id, autoresponses FROM guild_settings"
+        Returns the settings and whether every section was loaded.
+        """
+        settings = GuildSettings()
+        complete = True
+        for section in (
+            self.load_logging_settings,
+            self.load_greeter_settings,
+            self.load_autoroles,
+            self.load_message_settings,
+            self.load_auto_embedders,
+        ):
+            try:
+                await section(guild_id, settings)
+            except Exception as e:
+                logger.warning(f"{section.__name__} failed for guild {guild_id}: {e}")
+                complete = False
+
+        return settings, complete
+
+    async def load_logging_settings(self, guild_id: int, settings: GuildSettings):
+        if logging_settings := await self.bot.db.fetch_row(
+            """
+            SELECT member_log_channel_id, ban_log_channel_id, message_log_channel_id
+            FROM logging_settings WHERE guild_id = %s
+            """,
+            guild_id,
+        ):
+            (
+                settings.member_log_channel_id,
+                settings.ban_log_channel_id,
+                settings.message_log_channel_id,
+            ) = logging_settings
+
+        settings.message_log_ignored = frozenset(
+            await self.bot.db.fetch_flattened(
+                "SELECT channel_id FROM message_log_ignore WHERE guild_id = %s",
+                guild_id,
+            )
+        )
+
+    async def load_greeter_settings(self, guild_id: int, settings: GuildSettings):
+        if greeter := await self.bot.db.fetch_row(
+            """
+            SELECT channel_id, is_enabled, message_format
+            FROM greeter_settings WHERE guild_id = %s
+            """,
+            guild_id,
+        ):
+            settings.greeter = GreeterSettings(*greeter)
+
+        if goodbye := await self.bot.db.fetch_row(
+            """
+            SELECT channel_id, is_enabled, message_format
+            FROM goodbye_settings WHERE guild_id = %s
+            """,
+            guild_id,
+        ):
+            settings.goodbye = GreeterSettings(*goodbye)
+
+    async def load_autoroles(self, guild_id: int, settings: GuildSettings):
+        settings.autoroles = tuple(
+            await self.bot.db.fetch_flattened(
+                "SELECT role_id FROM autorole WHERE guild_id = %s",
+                guild_id,
+            )
         )
-        if guild_settings:
-            for guild_id, autoresponses in guild_settings:
-                self.autoresponse[str(guild_id)] = autoresponses
+
+    async def load_message_settings(self, guild_id: int, settings: GuildSettings):
+        if row := await self.bot.db.fetch_row(
+            "SELECT autoresponses, levelup_messages FROM guild_settings WHERE guild_id = %s",
+            guild_id,
+        ):
+            autoresponses, levelup_messages = row
+            settings.autoresponses = autoresponses is None or bool(autoresponses)
+            settings.levelup_messages = bool(levelup_messages)
+
+    async def load_auto_embedders(self, guild_id: int, settings: GuildSettings):
+        if enabled := await self.bot.db.fetch_row(
+            f"""
+            SELECT {", ".join(AUTO_EMBED_PROVIDERS)}
+            FROM media_auto_embed_enabled WHERE guild_id = %s
+            """,
+            guild_id,
+        ):
+            options = {
+                provider: (options or "", bool(reply))
+                for provider, options, reply in await self.bot.db.fetch(
+                    """
+                    SELECT provider, options, reply
+                    FROM media_auto_embed_options WHERE guild_id = %s
+                    """,
+                    guild_id,
+                )
+                or []
+            }
+            settings.auto_embedders = {
+                provider: AutoEmbedSettings(*options.get(provider, ("", False)))
+                for provider, is_enabled in zip(AUTO_EMBED_PROVIDERS, enabled)
+                if is_enabled
+            }
+
+    async def initialize_settings_cache(self):
+        logger.info("Caching settings...")
 
         self.blacklist = {
             "global": {
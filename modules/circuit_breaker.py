@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+from time import time
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from modules.misobot import MisoBot
+
+
+class CircuitState(Enum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        self.message = f"{name} is unavailable right now, try again in {int(retry_after) + 1} seconds"
+        super().__init__(self.message)
+
+
+class CircuitBreaker:
+    """Stops calling an external provider once too many of its recent calls have failed.
+
+    While open, calls fail immediately with CircuitOpen. After `open_duration` a single
+    trial call is let through, and its result decides whether the circuit closes again.
+    Opening is published in redis so every shard backs off the same provider.
+    """
+
+    SYNC_INTERVAL = 5
+
+    def __init__(
+        self,
+        bot: "MisoBot",
+        name: str,
+        window: int = 60,
+        min_calls: int = 5,
+        failure_ratio: float = 0.5,
+        open_duration: int = 60,
+    ):
+        self.bot = bot
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.open_duration = open_duration
+        self.state = CircuitState.CLOSED
+        self.open_until = 0.0
+        self.trial_running = False
+        self.last_sync = 0.0
+        # (timestamp, succeeded) of the calls made within the window
+        self.calls: deque[tuple[float, bool]] = deque()
+
+    @property
+    def redis_key(self):
+        return f"circuit:{self.name}"
+
+    @property
+    def is_open(self):
+        """Whether calls would currently be rejected, without asking redis"""
+        return self.state is CircuitState.OPEN and self.open_until > time()
+
+    async def sync(self):
+        """Pick up the circuit being opened by another shard"""
+        now = time()
+        if now - self.last_sync < self.SYNC_INTERVAL:
+            return
+
+        self.last_sync = now
+        try:
+            remote = await self.bot.redis.get(self.redis_key)
+        except Exception as e:
+            logger.warning(f"Could not read circuit {self.name} from redis: {e}")
+            return
+
+        if remote is not None and float(remote) > max(now, self.open_until):
+            self.set_state(CircuitState.OPEN)
+            self.open_until = float(remote)
+
+    async def check(self) -> bool:
+        """Raise CircuitOpen if the call should not be made, returns whether it's a trial call"""
+        await self.sync()
+        if self.state is CircuitState.CLOSED:
+            return False
+
+        now = time()
+        if self.state is CircuitState.OPEN and self.open_until > now:
+            self.reject(self.open_until - now)
+
+        if self.trial_running:
+            self.reject(self.open_duration)
+
+        self.set_state(CircuitState.HALF_OPEN)
+        self.trial_running = True
+        return True
+
+    def reject(self, retry_after: float):
+        self.count("rejected")
+        raise CircuitOpen(self.name, retry_after)
+
+    async def record(self, succeeded: bool, trial: bool = False):
+        self.count("success" if succeeded else "failure")
+        if trial:
+            if succeeded:
+                logger.info(f"Circuit {self.name} closed")
+                self.calls.clear()
+                self.set_state(CircuitState.CLOSED)
+            else:
+                await self.trip()
+            return
+
+        now = time()
+        self.calls.append((now, succeeded))
+        while self.calls and self.calls[0][0] < now - self.window:
+            self.calls.popleft()
+
+        failures = sum(1 for _, ok in self.calls if not ok)
+        if (
+            self.state is CircuitState.CLOSED
+            and len(self.calls) >= self.min_calls
+            and failures / len(self.calls) >= self.failure_ratio
+        ):
+            await self.trip()
+
+    async def trip(self, duration: int | None = None):
+        """Open the circuit on every shard, for example when rate limited"""
+        now = time()
+        # never shorten an opening that is already in effect
+        self.open_until = max(self.open_until, now + (duration or self.open_duration))
+        duration = int(self.open_until - now) + 1
+        self.calls.clear()
+        self.set_state(CircuitState.OPEN)
+        logger.warning(f"Circuit {self.name} opened for {duration} seconds")
+        try:
+            await self.bot.redis.set(self.redis_key, self.open_until, duration)
+        except Exception as e:
+            logger.warning(f"Could not publish circuit {self.name} to redis: {e}")
+
+    @asynccontextmanager
+    async def guard(self, ignore: tuple[type[BaseException], ...] = ()):
+        """Check the circuit and record the outcome of the wrapped call.
+
+        Exceptions in `ignore` are caused by the request itself, not the provider,
+        and count as successful calls. Cancelled calls are not recorded at all.
+        """
+        trial = await self.check()
+        try:
+            yield
+        except ignore:
+            await self.record(True, trial)
+            raise
+        except Exception:
+            await self.record(False, trial)
+            raise
+        else:
+            await self.record(True, trial)
+        finally:
+            if trial:
+                self.trial_running = False
+
+    def set_state(self, state: CircuitState):
+        self.state = state
+        if prom := self.bot.get_cog("Prometheus"):
+            prom.circuit_state.labels(circuit=self.name).set(state.value)  # type: ignore
+
+    def count(self, outcome: str):
+        if prom := self.bot.get_cog("Prometheus"):
+            prom.circuit_calls.labels(circuit=self.name, outcome=outcome).inc()  # type: ignore
+
+
+class CircuitBreakers:
+    """Breakers by provider name, created on first use"""
+
+    def __init__(self, bot: "MisoBot"):
+        self.bot = bot
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str, **options) -> CircuitBreaker:
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(self.bot, name, **options)
+        return breaker
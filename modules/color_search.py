@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# sRGB (D65) to CIE XYZ
+SRGB_TO_XYZ = np.array(
+    [
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ]
+)
+D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def rgb_to_lab(rgb) -> np.ndarray:
+    """Convert an (n, 3) array of 0-255 sRGB colors into CIELAB"""
+    srgb = np.asarray(rgb, dtype=np.float64).reshape(-1, 3) / 255.0
+    linear = np.where(
+        srgb <= 0.04045,
+        srgb / 12.92,
+        ((srgb + 0.055) / 1.055) ** 2.4,
+    )
+    xyz = (linear @ SRGB_TO_XYZ.T) / D65_WHITE
+
+    delta = 6 / 29
+    f = np.where(
+        xyz > delta**3,
+        np.cbrt(xyz),
+        xyz / (3 * delta**2) + 4 / 29,
+    )
+    lightness = 116 * f[:, 1] - 16
+    a = 500 * (f[:, 0] - f[:, 1])
+    b = 200 * (f[:, 1] - f[:, 2])
+    return np.column_stack((lightness, a, b))
+
+
+class ColorIndex:
+    """Nearest neighbour search of images by their dominant color in CIELAB space"""
+
+    def __init__(self, image_hashes: list[str], colors: list[tuple[int, int, int]]):
+        if not image_hashes:
+            raise ValueError("Cannot build a color index without any colors")
+
+        self.image_hashes = image_hashes
+        self.tree = cKDTree(rgb_to_lab(colors))
+
+    def __len__(self):
+        return len(self.image_hashes)
+
+    def query(self, palette: list[tuple[int, int, int]], k: int):
+        """Query all palette colors in one batch, returns (distances, indices) arrays"""
+        k = min(k, len(self))
+        distances, indices = self.tree.query(rgb_to_lab(palette), k=k)
+        return distances.reshape(len(palette), k), indices.reshape(len(palette), k)
+
+    def nearest(self, color: tuple[int, int, int], amount: int) -> list[str]:
+        """Get image hashes closest to the given color, closest first"""
+        _, indices = self.query([color], amount)
+        return [self.image_hashes[i] for i in indices[0]]
+
+    def nearest_for_palette(
+        self, palette: list[tuple[int, int, int]], amount: int
+    ) -> list[list[str]]:
+        """Get ranked image hashes for every palette color with no image shared between colors.
+
+        Images are handed out greedily in order of their distance to each palette color,
+        so every image ends up under the palette color it is closest to among those still
+        needing images. If the library is too small to fill every color with unique images,
+        the remaining slots are filled with the closest images regardless of duplicates.
+        """
+        distances, indices = self.query(palette, amount * len(palette))
+        chosen: list[list[int]] = [[] for _ in palette]
+        used = set()
+
+        order = np.argsort(distances, axis=None, kind="stable")
+        rows, columns = np.unravel_index(order, distances.shape)
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            index = int(indices[row, column])
+            if index in used or len(chosen[row]) >= amount:
+                continue
+            chosen[row].append(index)
+            used.add(index)
+
+        for row, picks in enumerate(chosen):
+            candidates = indices[row].tolist()
+            for index in candidates:
+                if len(picks) >= amount:
+                    break
+                if index not in picks:
+                    picks.append(index)
+
+            # query results are already sorted by distance for each palette color
+            rank = {index: position for position, index in enumerate(candidates)}
+            picks.sort(key=rank.__getitem__)
+
+        return [[self.image_hashes[i] for i in picks] for picks in chosen]
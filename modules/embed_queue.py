@@ -0,0 +1,139 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+import asyncio
+from collections import OrderedDict, defaultdict, deque
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from modules.misobot import MisoBot
+
+
+@dataclass
+class EmbedJob:
+    guild_id: int
+    provider: str
+    run: Callable[[], Awaitable]
+    queued_at: float = field(default_factory=monotonic)
+
+
+class EmbedQueue:
+    """Runs automatic embeds on a fixed pool of workers.
+
+    Guilds take turns, so a burst of links in one guild can't starve the others,
+    and both guilds and providers have a cap on how many of their embeds run at once.
+    The same link posted again in the same guild within the dedupe window is ignored.
+    """
+
+    WORKERS = 8
+    PER_GUILD = 2
+    PER_PROVIDER = 4
+    MAX_QUEUED_PER_GUILD = 20
+    DEDUPE_WINDOW = 60
+
+    def __init__(self, bot: "MisoBot"):
+        self.bot = bot
+        # guild_id -> jobs waiting, in the order guilds take turns
+        self.queues: OrderedDict[int, deque[EmbedJob]] = OrderedDict()
+        self.running_guilds: defaultdict[int, int] = defaultdict(int)
+        self.running_providers: defaultdict[str, int] = defaultdict(int)
+        # (guild_id, provider, link) -> when it was last queued
+        self.recent: OrderedDict[tuple[int, str, str], float] = OrderedDict()
+        self.wakeup = asyncio.Condition()
+        self.workers: list[asyncio.Task] = []
+
+    def start(self):
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.WORKERS)]
+
+    def stop(self):
+        for task in self.workers:
+            task.cancel()
+        self.workers = []
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def submit(
+        self, guild_id: int, provider: str, link: str, run: Callable[[], Awaitable]
+    ) -> bool:
+        """Queue an embed, returns False if it was a duplicate or the guild's queue is full"""
+        now = monotonic()
+        while (
+            self.recent and next(iter(self.recent.values())) < now - self.DEDUPE_WINDOW
+        ):
+            self.recent.popitem(last=False)
+
+        key = (guild_id, provider, link)
+        if key in self.recent:
+            self.count_dropped("duplicate")
+            return False
+
+        queue = self.queues.setdefault(guild_id, deque())
+        if len(queue) >= self.MAX_QUEUED_PER_GUILD:
+            self.count_dropped("full")
+            return False
+
+        self.recent[key] = now
+        queue.append(EmbedJob(guild_id, provider, run))
+        self.update_depth()
+        async with self.wakeup:
+            self.wakeup.notify()
+        return True
+
+    def next_job(self) -> EmbedJob | None:
+        """First job that fits the caps, guilds are rotated to the back after their turn"""
+        for guild_id, queue in self.queues.items():
+            if self.running_guilds.get(guild_id, 0) >= self.PER_GUILD:
+                continue
+
+            for job in queue:
+                if self.running_providers.get(job.provider, 0) < self.PER_PROVIDER:
+                    queue.remove(job)
+                    if queue:
+                        self.queues.move_to_end(guild_id)
+                    else:
+                        del self.queues[guild_id]
+                    return job
+
+        return None
+
+    async def worker(self):
+        while True:
+            async with self.wakeup:
+                while (job := self.next_job()) is None:
+                    await self.wakeup.wait()
+                self.running_guilds[job.guild_id] += 1
+                self.running_providers[job.provider] += 1
+
+            self.update_depth()
+            if prom := self.bot.get_cog("Prometheus"):
+                prom.embed_queue_wait.labels(provider=job.provider).observe(  # type: ignore
+                    monotonic() - job.queued_at
+                )
+
+            try:
+                await job.run()
+            except Exception as e:
+                logger.warning(f"Automatic {job.provider} embed failed: {e}")
+            finally:
+                async with self.wakeup:
+                    self.running_guilds[job.guild_id] -= 1
+                    if not self.running_guilds[job.guild_id]:
+                        del self.running_guilds[job.guild_id]
+                    self.running_providers[job.provider] -= 1
+                    # finishing may unblock jobs other workers had to skip
+                    self.wakeup.notify_all()
+
+    def update_depth(self):
+        if prom := self.bot.get_cog("Prometheus"):
+            prom.embed_queue_depth.set(self.depth)  # type: ignore
+
+    def count_dropped(self, reason: str):
+        if prom := self.bot.get_cog("Prometheus"):
+            prom.embed_jobs_dropped.labels(reason=reason).inc()  # type: ignore
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+from collections import OrderedDict
+from time import monotonic
+from typing import Iterable
+
+from modules.redis import Redis
+
+# returned when a key is in neither layer and the source of truth has to be asked
+NOT_CACHED = object()
+
+# stored in redis for keys known to have no value
+NEGATIVE_MARKER = ""
+
+
+class HotCache:
+    """In-process LRU in front of a shared redis namespace for small string values.
+
+    Storing None caches a negative result for the shorter `negative_lifetime`,
+    so lookups for things that do not exist don't hit the database every time.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        namespace: str,
+        maxsize: int,
+        lifetime: int,
+        negative_lifetime: int,
+    ):
+        self.redis = redis
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.lifetime = lifetime
+        self.negative_lifetime = negative_lifetime
+        # key -> (value, monotonic expiry time)
+        self.local: OrderedDict[str, tuple[str | None, float]] = OrderedDict()
+
+    def redis_key(self, key: str):
+        return f"{self.namespace}:{key}"
+
+    def get_local(self, key: str):
+        entry = self.local.get(key)
+        if entry is None:
+            return NOT_CACHED
+
+        value, expires_at = entry
+        if expires_at < monotonic():
+            del self.local[key]
+            return NOT_CACHED
+
+        self.local.move_to_end(key)
+        return value
+
+    def set_local(self, key: str, value: str | None, lifetime: int | None = None):
+        if lifetime is None:
+            lifetime = self.lifetime if value is not None else self.negative_lifetime
+
+        self.local[key] = (value, monotonic() + lifetime)
+        self.local.move_to_end(key)
+        while len(self.local) > self.maxsize:
+            self.local.popitem(last=False)
+
+    async def get(self, key: str):
+        """Get cached value, None for cached negative result or NOT_CACHED"""
+        return (await self.get_many([key]))[key]
+
+    async def get_many(self, keys: Iterable[str]) -> dict:
+        """Get many values at once, the redis layer is asked in a single round trip"""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.get_local(key)
+            if value is NOT_CACHED:
+                missing.append(key)
+            found[key] = value
+
+        if missing:
+            remote = await self.redis.get_many([self.redis_key(k) for k in missing])
+            for key, value in zip(missing, remote):
+                if value is None:
+                    continue
+
+                value = value.decode()
+                value = None if value == NEGATIVE_MARKER else value
+                # local copy is kept shorter so it can't outlive the redis value by much
+                self.set_local(key, value, self.negative_lifetime)
+                found[key] = value
+
+        return found
+
+    async def set(self, key: str, value: str | None, lifetime: int | None = None):
+        await self.set_many({key: value}, lifetime)
+
+    async def set_many(
+        self, values: dict[str, str | None], lifetime: int | None = None
+    ):
+        """Cache many values at once, None values are cached as negative results"""
+        positive = {}
+        negative = {}
+        for key, value in values.items():
+            self.set_local(key, value, lifetime)
+            if value is None:
+                negative[self.redis_key(key)] = NEGATIVE_MARKER
+            else:
+                positive[self.redis_key(key)] = value
+
+        await self.redis.set_many(positive, lifetime or self.lifetime)
+        await self.redis.set_many(negative, lifetime or self.negative_lifetime)
@@ -6,9 +6,11 @@ import asyncio
 import base64
 import os
 import re
+from collections import deque
 from dataclasses import dataclass
 from enum import Enum
-from typing import TYPE_CHECKING, override
+from time import monotonic
+from typing import TYPE_CHECKING, Awaitable, Callable, override
 from urllib import parse
 from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
 
@@ -20,6 +22,8 @@ from bs4 import BeautifulSoup
 from loguru import logger
 from markdownify import markdownify as md
 
+from modules.circuit_breaker import CircuitOpen
+
 if TYPE_CHECKING:
     from modules.misobot import MisoBot
 
@@ -48,6 +52,19 @@ class InstagramError(Exception):
         super().__init__(message)
 
 
+class InstagramPostUnavailable(InstagramError):
+    """Caused by the requested post itself, for example it doesn't exist or is private.
+    These don't count against the provider's circuit breaker.
+    """
+
+
+def status_error(status: int, message: str) -> InstagramError:
+    """Error for an unsuccessful response, not found style statuses are blamed on the post"""
+    if status in (400, 404, 410):
+        return InstagramPostUnavailable(message)
+    return InstagramError(message)
+
+
 class MediaType(Enum):
     PHOTO = 1
     VIDEO = 2
@@ -113,25 +130,22 @@ class EmbedEz:
         url = f"https://embedez.com/api/v1/providers/combined?q=https://instagram.com/p/{shortcode}"
         data = await self.try_cache(url)
         if data is None:
-            cooldown = await self.bot.redis.get("ez_on_cooldown")
-            if cooldown is not None:
-                raise InstagramError("API Error: Rate limited (cached)")
-
             async with self.bot.session.get(
                 url,
                 headers={"Authorization": self.bot.keychain.EZ_API_KEY},
             ) as response:
                 if not response.ok:
                     if response.status == 429:
-                        # rate limited
-                        await self.bot.redis.set("ez_on_cooldown", 1, 600)
-                        logger.info("Stopping EZ requests for one hour")
+                        # rate limited, stop every shard from trying for a while
+                        await self.bot.circuit_breakers.get("embedez").trip(600)
                         raise InstagramError("API Error: Rate limited")
                     else:
-                        raise InstagramError(f"API Error: {response.status}")
+                        raise status_error(
+                            response.status, f"API Error: {response.status}"
+                        )
                 data = await response.json()
                 if not data["success"]:
-                    raise InstagramError(f"API Error: {data['message']}")
+                    raise InstagramPostUnavailable(f"API Error: {data['message']}")
                 data = data["data"]
 
                 # cache this response for a day
@@ -143,7 +157,7 @@ class EmbedEz:
         ]
 
         if not media:
-            raise InstagramError("No media was found for this post")
+            raise InstagramPostUnavailable("No media was found for this post")
 
         return IgPost(
             url=data["content"]["link"],
@@ -247,7 +261,7 @@ class Snapsave:
             raise InstagramError("Network error in embedder connection")
 
         if not data["success"]:
-            raise InstagramError(data["message"])
+            raise InstagramPostUnavailable(data["message"])
 
         media = []
         for item in data["data"]["media"]:
@@ -259,7 +273,7 @@ class Snapsave:
             )
 
         if not media:
-            raise InstagramError("No media found!")
+            raise InstagramPostUnavailable("No media found!")
 
         # remove possible duplicates
         return list(dict.fromkeys(media))
@@ -283,8 +297,9 @@ class InstaFix:
                     },
                 ) as response:
                     if not response.ok:
-                        raise InstagramError(
-                            f"Unable to scrape post: HTTP {response.status}"
+                        raise status_error(
+                            response.status,
+                            f"Unable to scrape post: HTTP {response.status}",
                         )
                     data = await response.read()
                     # because the world is not perfect, and a server that
@@ -342,7 +357,9 @@ class InstaFix:
         media = await self.try_media(shortcode)
 
         if not media:
-            raise InstagramError("There was a problem finding media for this post")
+            raise InstagramPostUnavailable(
+                "There was a problem finding media for this post"
+            )
 
         return IgPost(
             url=metadata["url"],
@@ -423,10 +440,14 @@ class Datalama:
                     or data.get("exc_type") is not None
                     or data.get("detail") is not None
                 ):
-                    raise InstagramError(
+                    message = (
                         f"API returned **{response.status} {data.get('detail')}**"
                         f"```json\n{params}```"
                     )
+                    if response.ok:
+                        # the api answered fine but can't give this media
+                        raise InstagramPostUnavailable(message)
+                    raise status_error(response.status, message)
 
                 return data
 
@@ -584,6 +605,163 @@ class Datalama:
         )
 
 
+@dataclass
+class ProviderStats:
+    success_rate: float = 1.0
+    latency: float | None = None
+
+    def expected_cost(self) -> float:
+        """Rough expected time to get a post from this provider, unknown providers go last"""
+        if self.latency is None:
+            return float("inf")
+        return self.latency / max(self.success_rate, 0.05)
+
+
+class InstagramResolver:
+    """Races the instagram providers against each other.
+
+    The provider expected to be fastest is started first, and the next one is started
+    if it hasn't answered within the hedge delay or fails. The first post wins and the
+    rest are cancelled. Providers whose circuit breaker is open are skipped.
+    """
+
+    HEDGE_DELAY = 3.0
+    MIN_HEDGE_DELAY = 0.5
+    PROVIDER_TIMEOUT = 30
+    SMOOTHING = 0.2
+
+    def __init__(self, bot: "MisoBot", hedge_delay: float | None = None):
+        self.bot = bot
+        self.hedge_delay = hedge_delay or float(
+            os.environ.get("INSTAGRAM_HEDGE_DELAY", self.HEDGE_DELAY)
+        )
+        self.stats: dict[str, ProviderStats] = {}
+
+    def post_providers(self, shortcode: str):
+        providers = {
+            "snapsave": lambda: Snapsave(self.bot.session).get_post(shortcode),
+            "instafix": lambda: InstaFix(self.bot.session).get_post(shortcode),
+        }
+        if self.bot.keychain.EZ_API_KEY:
+            providers["embedez"] = lambda: EmbedEz(self.bot).get_post(shortcode)
+        if self.bot.keychain.DATALAMA_ACCESS_KEY:
+            providers["datalama"] = lambda: Datalama(self.bot).get_post(shortcode)
+        return providers
+
+    def story_providers(self, story_id: int, username: str):
+        providers = {
+            "snapsave": lambda: Snapsave(self.bot.session).get_story(
+                story_id, username
+            ),
+        }
+        if self.bot.keychain.DATALAMA_ACCESS_KEY:
+            providers["datalama"] = lambda: Datalama(self.bot).get_story(
+                username, str(story_id)
+            )
+        return providers
+
+    async def get_post(
+        self, shortcode: str, exclude: set[str] | None = None
+    ) -> tuple[str, IgPost]:
+        return await self.race(self.post_providers(shortcode), exclude)
+
+    async def get_story(
+        self, story_id: int, username: str, exclude: set[str] | None = None
+    ) -> tuple[str, IgPost]:
+        return await self.race(self.story_providers(story_id, username), exclude)
+
+    def ordered(self, names: list[str]) -> list[str]:
+        """Providers by expected cost, ones with an open circuit are left out if possible"""
+        for name in names:
+            self.stats.setdefault(name, ProviderStats())
+        available = [
+            name for name in names if not self.bot.circuit_breakers.get(name).is_open
+        ] or names
+        return sorted(available, key=lambda name: self.stats[name].expected_cost())
+
+    def next_hedge_delay(self, name: str) -> float:
+        """Wait a bit longer than the provider usually takes, but never over the hedge delay"""
+        latency = self.stats[name].latency
+        if latency is None:
+            return self.hedge_delay
+        return min(self.hedge_delay, max(self.MIN_HEDGE_DELAY, latency * 1.5))
+
+    def record_success(self, name: str, latency: float):
+        stats = self.stats.setdefault(name, ProviderStats())
+        stats.success_rate += (1 - stats.success_rate) * self.SMOOTHING
+        stats.latency = (
+            latency
+            if stats.latency is None
+            else stats.latency + (latency - stats.latency) * self.SMOOTHING
+        )
+
+    def record_failure(self, name: str):
+        stats = self.stats.setdefault(name, ProviderStats())
+        stats.success_rate -= stats.success_rate * self.SMOOTHING
+
+    async def call(self, name: str, provider: Callable[[], Awaitable[IgPost]]):
+        # only provider errors count towards opening the circuit, not unavailable posts
+        async with self.bot.circuit_breakers.get(name).guard(
+            ignore=(InstagramPostUnavailable,)
+        ):
+            return await asyncio.wait_for(provider(), self.PROVIDER_TIMEOUT)
+
+    async def race(
+        self,
+        providers: dict[str, Callable[[], Awaitable[IgPost]]],
+        exclude: set[str] | None = None,
+    ) -> tuple[str, IgPost]:
+        queue = deque(self.ordered([n for n in providers if n not in (exclude or ())]))
+        if not queue:
+            raise InstagramError("No Instagram providers left to try")
+
+        running: dict[asyncio.Task, tuple[str, float]] = {}
+        error: Exception | None = None
+        try:
+            while queue or running:
+                # a pass after the first means the hedge delay ran out or a provider failed
+                if queue:
+                    name = queue.popleft()
+                    task = asyncio.create_task(self.call(name, providers[name]))
+                    running[task] = (name, monotonic())
+                    timeout = self.next_hedge_delay(name)
+
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=timeout if queue else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    name, started_at = running.pop(task)
+                    try:
+                        post = task.result()
+                    except CircuitOpen as e:
+                        error = e
+                        continue
+                    except InstagramPostUnavailable as e:
+                        # not the provider's fault, the others may still be able to find it
+                        logger.info(
+                            f"Instagram provider {name} could not get post: {e}"
+                        )
+                        error = e
+                        continue
+                    except Exception as e:
+                        logger.warning(f"Instagram provider {name} failed with {e}")
+                        self.record_failure(name)
+                        error = e
+                        continue
+
+                    self.record_success(name, monotonic() - started_at)
+                    return name, post
+        finally:
+            for task in running:
+                task.cancel()
+
+        if isinstance(error, InstagramError):
+            raise error
+        raise InstagramError(f"Unable to fetch this post ({error})")
+
+
 def remove_params(url: str, params_to_remove: list[str]):
     parsed = urlparse(url)
     query = parse_qs(parsed.query, keep_blank_values=True)
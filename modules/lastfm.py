@@ -6,7 +6,10 @@ import asyncio
 import json
 import math
 import urllib.parse
+from collections import deque
+from contextlib import aclosing
 from enum import Enum
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
 
 import aiohttp
 import arrow
@@ -15,6 +18,7 @@ from bs4 import BeautifulSoup, Tag
 from loguru import logger
 
 from modules import exceptions
+from modules.hotcache import NOT_CACHED, HotCache
 from modules.misobot import MisoBot
 
 
@@ -23,6 +27,9 @@ def int_bool(value: bool | None) -> int | None:
     return int(value) if value is not None else None
 
 
+T = TypeVar("T")
+
+
 def non_empty(data: dict):
     if not data:
         raise exceptions.LastFMError(error_code=0, message="Last.fm returned no data")
@@ -127,8 +134,18 @@ class LastFmApi:
         "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/119.0"
     )
 
+    # how long a scraped artist image is used before scraping it again
+    ARTIST_IMAGE_LIFETIME = 604800  # 1 week
+
     def __init__(self, bot: MisoBot):
         self.bot = bot
+        self.artist_image_cache = HotCache(
+            bot.redis,
+            "lastfm-artist-image",
+            maxsize=5000,
+            lifetime=86400,
+            negative_lifetime=3600,
+        )
 
     async def login(self, username: str, password: str) -> bool:
         """Login to lastfm for authenticated web scraping requests"""
@@ -315,6 +332,111 @@ class LastFmApi:
         )
         return non_empty(data["toptracks"])
 
+    ##############
+    # PAGINATION #
+    ##############
+
+    @staticmethod
+    async def iter_pages(
+        fetch_page: Callable[[int], Awaitable[T]],
+        page_count: int,
+        first_page: int = 1,
+        prefetch: int = 2,
+    ) -> AsyncIterator[T]:
+        """Fetch pages in order, keeping at most `prefetch` requests in flight.
+        Pages that were requested but never consumed are cancelled when the iterator is closed.
+        """
+        pending: deque[asyncio.Task] = deque()
+        next_page = first_page
+        try:
+            while pending or next_page <= page_count:
+                while next_page <= page_count and len(pending) < prefetch:
+                    pending.append(asyncio.create_task(fetch_page(next_page)))
+                    next_page += 1
+
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def iter_paginated(
+        self,
+        fetch_page: Callable[[int, int], Awaitable[dict]],
+        data_key: str,
+        limit: int | None,
+        per_page: int,
+        prefetch: int = 2,
+    ) -> AsyncIterator[dict]:
+        """Stream items of a paginated api method, never requesting more than `limit` items.
+        `fetch_page` is called with the page number and the page size.
+        """
+        if limit is not None:
+            per_page = max(min(per_page, limit), 1)
+
+        def fetch(page: int):
+            return fetch_page(page, per_page)
+
+        first = await fetch(1)
+        page_count = int(first["@attr"]["totalPages"])
+        if limit is not None:
+            page_count = min(page_count, math.ceil(limit / per_page))
+
+        count = 0
+        for item in first[data_key]:
+            if limit is not None and count >= limit:
+                return
+            count += 1
+            yield item
+
+        async with aclosing(
+            self.iter_pages(fetch, page_count, first_page=2, prefetch=prefetch)
+        ) as pages:
+            async for data in pages:
+                for item in data[data_key]:
+                    if limit is not None and count >= limit:
+                        return
+                    count += 1
+                    yield item
+
+    def iter_top_albums(
+        self,
+        username: str,
+        period: Period | None = None,
+        limit: int | None = None,
+        per_page: int = 500,
+    ) -> AsyncIterator[dict]:
+        """Stream the top albums of a user, fetching only as many pages as needed."""
+        return self.iter_paginated(
+            lambda page, page_size: self.user_get_top_albums(
+                username, period, page_size, page
+            ),
+            "album",
+            limit,
+            per_page,
+        )
+
+    def iter_recent_tracks(
+        self,
+        username: str,
+        limit: int | None = None,
+        per_page: int = 200,
+        from_ts: int | None = None,
+        to_ts: int | None = None,
+    ) -> AsyncIterator[dict]:
+        """Stream the scrobble history of a user, newest first.
+
+        Every page is requested by number, so unlike a plain user_get_recent_tracks call
+        the currently playing track is left out, also from the first page.
+        """
+        return self.iter_paginated(
+            lambda page, page_size: self.user_get_recent_tracks(
+                username, page_size, page, from_ts=from_ts, to_ts=to_ts
+            ),
+            "track",
+            limit,
+            per_page,
+        )
+
     async def artist_get_info(
         self,
         artist: str,
@@ -431,11 +553,13 @@ class LastFmApi:
 
         return results
 
-    async def get_additional_library_pages(self, soup: BeautifulSoup, url: str) -> list:
-        """Check for pagination on listing page and fetch all the remaining pages."""
+    async def iter_additional_library_pages(
+        self, soup: BeautifulSoup, url: str, prefetch: int = 4
+    ) -> AsyncIterator[list[tuple[int, str]]]:
+        """Check for pagination on listing page and stream the remaining pages."""
         pages = soup.select(".pagination-page")
         if not pages:
-            return []
+            return
 
         page_count = int(pages[-1].get_text())
 
@@ -444,47 +568,98 @@ class LastFmApi:
             soup = await self.scrape_page(new_url)
             return self.get_library_playcounts(soup)
 
-        tasks = []
-        if page_count > 1:
-            for i in range(2, page_count + 1):
-                tasks.append(get_additional_page(i))
-
-        results = []
-        for result in await asyncio.gather(*tasks):
-            results += result
+        async with aclosing(
+            self.iter_pages(
+                get_additional_page, page_count, first_page=2, prefetch=prefetch
+            )
+        ) as results:
+            async for result in results:
+                yield result
+
+    async def get_artist_image(self, artist_name: str) -> LastFmImage | None:
+        return (await self.get_artist_images([artist_name]))[artist_name]
+
+    async def get_artist_images(
+        self, artist_names: list[str]
+    ) -> dict[str, LastFmImage | None]:
+        """Get images of many artists, scraping only the ones not cached anywhere"""
+        hashes = await self.artist_image_cache.get_many(artist_names)
+        missing = [
+            name for name, image_hash in hashes.items() if image_hash is NOT_CACHED
+        ]
+
+        if missing:
+            # the column collation is case insensitive, match the rows the same way
+            rows = {
+                artist_name.lower(): (image_hash, scrape_date)
+                for artist_name, image_hash, scrape_date in await self.bot.db.fetch(
+                    """
+                    SELECT artist_name, image_hash, scrape_date FROM artist_image_cache
+                    WHERE artist_name IN %s
+                    """,
+                    missing,
+                )
+                or []
+            }
+            now = arrow.now().timestamp()
+            warm = {}
+            for artist_name in missing:
+                image_hash, scrape_date = rows.get(artist_name.lower(), (None, None))
+                if image_hash is None:
+                    continue
+
+                remaining = self.ARTIST_IMAGE_LIFETIME - (now - scrape_date.timestamp())
+                if remaining <= 0:
+                    continue
+
+                hashes[artist_name] = image_hash
+                if remaining >= self.artist_image_cache.lifetime:
+                    warm[artist_name] = image_hash
+                else:
+                    # don't let the cache outlive the scrape
+                    await self.artist_image_cache.set(
+                        artist_name, image_hash, int(remaining)
+                    )
 
-        return results
+            await self.artist_image_cache.set_many(warm)
+            missing = [name for name in missing if hashes[name] is NOT_CACHED]
 
-    async def get_artist_image(self, artist_name: str):
-        IMAGE_LIFETIME = 604800  # 1 week
-        cached = await self.bot.db.fetch_row(
-            "SELECT image_hash, scrape_date FROM artist_image_cache WHERE artist_name = %s",
-            artist_name,
-        )
+        if missing:
+            scraped = await asyncio.gather(
+                *(self.scrape_artist_image(name) for name in missing)
+            )
+            found = {}
+            for artist_name, image in zip(missing, scraped):
+                if image is None or image.is_missing():
+                    hashes[artist_name] = None
+                    continue
 
-        if cached:
-            image_hash, scrape_date = cached
-            lifetime = arrow.now().timestamp() - scrape_date.timestamp()
-            if lifetime < IMAGE_LIFETIME:
-                return LastFmImage(image_hash)
+                hashes[artist_name] = image.hash
+                found[artist_name] = image.hash
 
-        image = await self.scrape_artist_image(artist_name)
-        if image is None or image.is_missing():
-            return None
+            await self.artist_image_cache.set_many(
+                {name: hashes[name] for name in missing}
+            )
+            if found:
+                scrape_date = arrow.now().datetime
+                await self.bot.db.executemany(
+                    """
+                    INSERT INTO artist_image_cache (artist_name, image_hash, scrape_date)
+                        VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        image_hash = VALUES(image_hash),
+                        scrape_date = VALUES(scrape_date)
+                    """,
+                    [
+                        (name, image_hash, scrape_date)
+                        for name, image_hash in found.items()
+                    ],
+                )
 
-        await self.bot.db.execute(
-            """
-            INSERT INTO artist_image_cache (artist_name, image_hash, scrape_date)
-                VALUES (%s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                image_hash = VALUES(image_hash),
-                scrape_date = VALUES(scrape_date)
-            """,
-            artist_name,
-            image.hash,
-            arrow.now().datetime,
-        )
-        return image
+        return {
+            name: None if image_hash is None else LastFmImage(image_hash)
+            for name, image_hash in hashes.items()
+        }
 
     async def scrape_artist_image(self, artist: str) -> LastFmImage | None:
         """Get artist's top image."""
@@ -0,0 +1,133 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO
+
+import arrow
+from loguru import logger
+
+
+@dataclass
+class CachedMedia:
+    path: Path
+    size: int
+    ext: str
+    expires_at: int
+
+
+class MediaCache:
+    """Downloaded media on disk, indexed in memory and evicted by total size.
+
+    Keys are normalized source ids like `instagram:{shortcode}:{n}`,
+    so the same post embedded in many guilds is only downloaded once.
+    The index is not persisted, so the cache's own subdirectory of `directory`
+    is emptied on startup. Nothing else in `directory` is touched.
+    """
+
+    DEFAULT_LIFETIME = 6 * 60 * 60
+    SUBDIRECTORY = "miso-media-cache"
+
+    def __init__(self, directory: str | None = None, max_bytes: int | None = None):
+        self.directory = (
+            Path(
+                directory or os.environ.get("MEDIA_CACHE_DIR") or tempfile.gettempdir()
+            )
+            / self.SUBDIRECTORY
+        )
+        self.max_bytes = (
+            max_bytes
+            if max_bytes is not None
+            else int(os.environ.get("MEDIA_CACHE_SIZE_MB", 1024)) * 1024 * 1024
+        )
+        self.index: OrderedDict[str, CachedMedia] = OrderedDict()
+        self.total_bytes = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(source: str, *parts) -> str:
+        return ":".join([source, *map(str, parts)])
+
+    def get(self, key: str, max_filesize: int) -> tuple[IO[bytes], str] | None:
+        """Open the cached file for reading if it exists, fits the limit and hasn't expired"""
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+
+        if entry.expires_at <= arrow.utcnow().int_timestamp:
+            self.evict(key)
+            return None
+
+        if entry.size >= max_filesize:
+            return None
+
+        try:
+            file = entry.path.open("rb")
+        except FileNotFoundError:
+            self.evict(key)
+            return None
+
+        self.index.move_to_end(key)
+        return file, entry.ext
+
+    async def store(
+        self, key: str, file: IO[bytes], ext: str, expires_at: int | None = None
+    ):
+        """Copy a downloaded file into the cache, the file is rewound afterwards"""
+        now = arrow.utcnow().int_timestamp
+        expires_at = min(
+            expires_at or now + self.DEFAULT_LIFETIME, now + self.DEFAULT_LIFETIME
+        )
+        if expires_at <= now:
+            return
+
+        path = self.directory / f"{hashlib.sha1(key.encode()).hexdigest()}.{ext}"
+        try:
+            size = await asyncio.to_thread(self.write_file, path, file)
+        except OSError as e:
+            logger.warning(f"Could not write {key} into the media cache: {e}")
+            return
+        finally:
+            file.seek(0)
+
+        if size > self.max_bytes:
+            path.unlink(missing_ok=True)
+            return
+
+        if key in self.index:
+            self.total_bytes -= self.index.pop(key).size
+
+        self.index[key] = CachedMedia(path, size, ext, expires_at)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self.evict(next(iter(self.index)))
+
+    @staticmethod
+    def write_file(path: Path, file: IO[bytes]) -> int:
+        file.seek(0)
+        # a unique partial file, the same media may be stored by two embeds at once
+        fd, partial = tempfile.mkstemp(dir=path.parent, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as target:
+                shutil.copyfileobj(file, target, 1024 * 1024)
+                size = target.tell()
+            # readers holding the old file keep their handle, new ones get the complete file
+            os.replace(partial, path)
+        except BaseException:
+            Path(partial).unlink(missing_ok=True)
+            raise
+        return size
+
+    def evict(self, key: str):
+        entry = self.index.pop(key)
+        self.total_bytes -= entry.size
+        entry.path.unlink(missing_ok=True)
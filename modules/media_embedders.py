@@ -5,23 +5,33 @@
 import asyncio
 import io
 import subprocess
-import urllib.request
+import tempfile
+from dataclasses import asdict
 from pathlib import Path
-from typing import TYPE_CHECKING, Any
+from time import monotonic
+from typing import IO, TYPE_CHECKING, Any, Iterable
+from urllib.parse import parse_qs, urlparse
 
 import arrow
 import discord
+import orjson
 import regex
 import yarl
-from aiohttp import ClientConnectorError
+from aiohttp import (
+    ClientConnectorError,
+    ClientError,
+    ClientResponseError,
+    ClientTimeout,
+)
 from attr import dataclass
 from discord.ext import commands
 from discord.ui import View
 from loguru import logger
 
 from modules import emojis, exceptions, instagram, util
-from modules.instagram import InstagramError, Snapsave
-from modules.tiktok import TikTokNew
+from modules.hotcache import NOT_CACHED
+from modules.instagram import Datalama, InstagramError, InstagramResolver
+from modules.tiktok import TikTokNew, TikTokVideo
 
 if TYPE_CHECKING:
     from modules.misobot import MisoBot
@@ -38,6 +48,18 @@ class InstagramStory:
     id: int
 
 
+@dataclass
+class InstagramShare:
+    """Share link, resolved into a post or story by following its redirect when embedded"""
+
+    share_type: str
+    code: str
+
+    @property
+    def url(self):
+        return f"https://instagram.com/share/{self.share_type}/{self.code}"
+
+
 @dataclass
 class Options:
     captions: bool = False
@@ -46,6 +68,78 @@ class Options:
     sanitized_string: str = ""
 
 
+# one pass over the message finds the links of every provider
+INSTAGRAM_LINK = (
+    r"(?:https?://)?(?:www.)?instagram.com/"
+    r"(?P<ig_1>[a-zA-Z0-9._\-]+)/(?P<ig_2>[a-zA-Z0-9._\-]+)/?(?P<ig_3>[a-zA-Z0-9._\-]+)?"
+)
+LINK_PATTERN = regex.compile(
+    "|".join(
+        [
+            INSTAGRAM_LINK,
+            r"\bhttps?://(?:m\.|www\.|vm\.|)tiktok\.com/\S*?\b"
+            r"(?:(?:usr|v|embed|user|video|t)/|\?shareId=|&item_id=)(?P<tiktok_id>\d+)\S*",
+            r"\bhttps?://(?:vm|vt|www)\.tiktok\.com/(?:t/|)(?P<tiktok_code>\w+)/?",
+            r"(?:https?://)?(?:www.)?(?:twitter|x).com/\w+/status/(?P<tweet_id>\d+)",
+        ]
+    )
+)
+INSTAGRAM_PATTERN = regex.compile(INSTAGRAM_LINK)
+# bare shortcodes and tweet ids are only accepted in commands
+SHORTCODE_PATTERN = regex.compile(r"(?:\s|^)([^-][a-zA-Z0-9\-\_\.]{9,})(?=\s|$)")
+LINK_DOMAINS = ("instagram.com", "tiktok.com", "twitter.com", "x.com")
+INSTAGRAM_POST_PATHS = frozenset(["p", "reel", "reels", "tv"])
+
+
+def instagram_asset(
+    fragments: list[str | None],
+) -> "InstagramPost | InstagramStory | InstagramShare":
+    """Turn the path of an instagram link into a post, story or share link"""
+    # the first part may be a username if it was clicked through a profile
+    for candidate in (fragments, fragments[1:]):
+        url_type, *rest = candidate
+        if url_type in INSTAGRAM_POST_PATHS and rest[0]:
+            return InstagramPost(shortcode=rest[0])
+
+        if url_type == "stories" and len(rest) > 1 and rest[1] and rest[1].isdigit():
+            return InstagramStory(username=rest[0], id=int(rest[1]))
+
+        if url_type == "share" and rest[0] and len(rest) > 1 and rest[1]:
+            # the redirect is followed later, scanning a message never does network requests
+            return InstagramShare(share_type=rest[0], code=rest[1])
+
+    raise InstagramError(f"Unsupported instagram path `/{fragments[0]}/`")
+
+
+def scan_links(text: str, strict: bool = True) -> list[tuple[str, Any]]:
+    """Find the supported links of every provider, as (provider, media) in message order.
+
+    The media is an InstagramPost, InstagramStory or InstagramShare, a TikTok url or a tweet id.
+    Unsupported instagram links raise InstagramError, or are skipped if not strict.
+    """
+    if not any(domain in text for domain in LINK_DOMAINS):
+        return []
+
+    results = []
+    for match in LINK_PATTERN.finditer(text):
+        if match["ig_1"] is not None:
+            try:
+                asset = instagram_asset([match["ig_1"], match["ig_2"], match["ig_3"]])
+            except InstagramError:
+                if strict:
+                    raise
+                continue
+            results.append(("instagram", asset))
+        elif match["tiktok_id"] is not None:
+            results.append(("tiktok", f"https://m.tiktok.com/v/{match['tiktok_id']}"))
+        elif match["tiktok_code"] is not None:
+            results.append(("tiktok", f"https://vm.tiktok.com/{match['tiktok_code']}"))
+        else:
+            results.append(("twitter", int(match["tweet_id"])))
+
+    return results
+
+
 def filesize_limit(guild: discord.Guild | None):
     """discord normally has 8MB file size limit,
     but it can be increased in some guilds due to boosting
@@ -64,17 +158,79 @@ def nsfw_check(channel: "discord.abc.MessageableChannel", post_is_nsfw: bool):
         )
 
 
+def url_expiry(media_url: str) -> int | None:
+    """Expiry timestamp of a signed CDN url, if it has one"""
+    query = parse_qs(urlparse(media_url).query)
+    try:
+        if "oe" in query:
+            return Datalama.get_url_expiry(media_url)
+        for param in ("x-expires", "expires", "Expires"):
+            if param in query:
+                return int(query[param][0])
+    except ValueError:
+        pass
+    return None
+
+
+# resolved post metadata is kept at most this long, less if its media urls expire sooner
+METADATA_LIFETIME = 3600
+METADATA_EXPIRY_MARGIN = 60
+
+
+def metadata_lifetime(media_urls: Iterable[str]) -> int:
+    now = arrow.utcnow().int_timestamp
+    lifetime = METADATA_LIFETIME
+    for media_url in media_urls:
+        expiry = url_expiry(media_url)
+        if expiry is not None:
+            lifetime = min(lifetime, expiry - now - METADATA_EXPIRY_MARGIN)
+    return lifetime
+
+
+def file_size(file: IO[bytes]) -> int:
+    size = file.seek(0, io.SEEK_END)
+    file.seek(0)
+    return size
+
+
 class DownloadError(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(message)
 
 
+class ByteBudget:
+    """Bytes the downloads of one embed may still take up together"""
+
+    def __init__(self, limit: int):
+        self.remaining = limit
+
+    def take(self, amount: int) -> bool:
+        if amount > self.remaining:
+            return False
+        self.remaining -= amount
+        return True
+
+    def give_back(self, amount: int):
+        self.remaining += amount
+
+
 class BaseEmbedder:
     NO_RESULTS_ERROR = "..."
     NAME = "..."
     EMOJI = "..."
 
+    # downloads are read in large chunks and kept in memory only up to the spool size
+    DOWNLOAD_CHUNK_SIZE = 256 * 1024
+    DOWNLOAD_SPOOL_SIZE = 4 * 1024 * 1024
+    # videos over the guild's limit are still downloaded up to this size to be transcoded
+    TRANSCODE_SOURCE_LIMIT = 200 * 1024 * 1024
+    TRANSCODE_PROGRESS_INTERVAL = 3
+    # multi-item posts are downloaded a few items at a time, under one budget for the whole embed
+    FILES_PER_MESSAGE = 10
+    DOWNLOAD_CONCURRENCY = 4
+    EMBED_BYTES_BUDGET = 256 * 1024 * 1024
+
     def __init__(self, bot) -> None:
         self.bot: "MisoBot" = bot
 
@@ -138,8 +294,36 @@ class BaseEmbedder:
         max_filesize: int,
         url_tags: list[str] | None = None,
         spoiler: bool = False,
+        cache_key: str | None = None,
+        expires_at: int | None = None,
+        channel: "discord.abc.MessageableChannel | None" = None,
+        budget: ByteBudget | None = None,
     ) -> str | discord.File:
-        """Downloads media content respecting discord's filesize limit for each guild"""
+        """Downloads media content respecting discord's filesize limit for each guild.
+
+        If a cache key is given, the download is shared with other embeds of the same media
+        through the media cache until `expires_at` or the default cache lifetime.
+        Videos that are too big are transcoded to fit if possible,
+        showing the progress in `channel`.
+        Files that don't fit in the `budget` shared by the embed are linked instead.
+        """
+        transcoded_key = None
+        if cache_key is not None:
+            transcoded_key = f"{cache_key}:{max_filesize}"
+            cached = self.bot.media_cache.get(
+                cache_key, max_filesize
+            ) or self.bot.media_cache.get(transcoded_key, max_filesize)
+            if cached is not None:
+                file, cached_ext = cached
+                if budget is None or budget.take(file_size(file)):
+                    return discord.File(
+                        fp=file, filename=f"{filename}.{cached_ext}", spoiler=spoiler
+                    )
+                file.close()
+                return await self.media_link(
+                    media_url, url_tags, spoiler, cache_key, expires_at
+                )
+
         # The url params are unescaped by aiohttp's built-in yarl
         # This causes problems with the hash-based request signing that instagram uses
         # Thankfully you can plug your own yarl.URL with encoded=True so it wont get encoded twice
@@ -167,36 +351,57 @@ class BaseEmbedder:
 
             filename = f"{filename}.{ext}"
 
+            download_limit = max_filesize
+            if ext == "mp4" and self.bot.transcoder.enabled:
+                download_limit = max(max_filesize, self.TRANSCODE_SOURCE_LIMIT)
+
+            file = None
             content_length = response.headers.get(
                 "Content-Length"
             ) or response.headers.get("x-full-image-content-length")
-            try:
-                if content_length:
-                    if int(content_length) < max_filesize:
-                        try:
-                            file = io.BytesIO(await response.read())
-                            return discord.File(
-                                fp=file, filename=filename, spoiler=spoiler
-                            )
-                        except asyncio.TimeoutError:
-                            pass
-                    else:
-                        raise ValueError
-                else:
-                    # try to stream until we hit our limit
-                    buffer: bytes = b""
-                    async for chunk in response.content.iter_chunked(1024):
-                        buffer += chunk
-                        if len(buffer) > max_filesize:
-                            raise ValueError
-                    return discord.File(
-                        fp=io.BytesIO(buffer), filename=filename, spoiler=spoiler
-                    )
-            except ValueError:
-                pass
+            if not content_length or (
+                int(content_length) < download_limit
+                and (budget is None or int(content_length) <= budget.remaining)
+            ):
+                file = await self.stream_to_file(response, download_limit, budget)
+
+        store_key = cache_key
+        if file is not None and (source_size := file_size(file)) >= max_filesize:
+            source = file
+            file = await self.transcode_video(source, max_filesize, channel)
+            source.close()
+            store_key = transcoded_key
+            if budget is not None:
+                budget.give_back(source_size)
+                if file is not None and not budget.take(file_size(file)):
+                    file.close()
+                    file = None
+
+        if file is not None:
+            if store_key is not None:
+                await self.bot.media_cache.store(store_key, file, ext, expires_at)
+            return discord.File(fp=file, filename=filename, spoiler=spoiler)
+
+        return await self.media_link(
+            media_url, url_tags, spoiler, cache_key, expires_at
+        )
 
+    async def media_link(
+        self,
+        media_url: str,
+        url_tags: list[str] | None = None,
+        spoiler: bool = False,
+        cache_key: str | None = None,
+        expires_at: int | None = None,
+    ) -> str:
+        """Link to media that can't be uploaded, shortened links are reused until the url expires"""
         try:
-            media_url = await util.shorten_url(self.bot, media_url, tags=url_tags)
+            media_url = await self.bot.url_shortener.shorten(
+                media_url,
+                tags=url_tags,
+                key=cache_key,
+                expires_at=expires_at or url_expiry(media_url),
+            )
         except ClientConnectorError:
             pass
 
@@ -205,18 +410,185 @@ class BaseEmbedder:
 
         return media_url
 
+    async def download_batched(
+        self, downloads: list[dict]
+    ) -> tuple[list[str | discord.File], list[asyncio.Task]]:
+        """Download the items of a post a few at a time, under one byte budget.
+
+        Returns the results for the first message as soon as they are ready,
+        along with the tasks of the remaining items that keep downloading meanwhile.
+        Download errors in the first message are raised, later items are linked instead.
+        """
+        budget = ByteBudget(self.EMBED_BYTES_BUDGET)
+        # waiters are woken in order, so the items of the first message go first
+        slots = asyncio.Semaphore(self.DOWNLOAD_CONCURRENCY)
+
+        async def download(n: int, arguments: dict):
+            async with slots:
+                try:
+                    return await self.download_media(**arguments, budget=budget)
+                except DownloadError as e:
+                    if n < self.FILES_PER_MESSAGE:
+                        raise
+                    logger.warning(f"Linking item {n + 1} instead: {e}")
+                    return await self.media_link(
+                        arguments["media_url"],
+                        arguments.get("url_tags"),
+                        arguments.get("spoiler", False),
+                        arguments.get("cache_key"),
+                        arguments.get("expires_at"),
+                    )
+
+        tasks = [
+            asyncio.create_task(download(n, arguments))
+            for n, arguments in enumerate(downloads)
+        ]
+        try:
+            results = await asyncio.gather(*tasks[: self.FILES_PER_MESSAGE])
+        except BaseException:
+            self.discard_downloads(tasks)
+            raise
+
+        return results, tasks[self.FILES_PER_MESSAGE :]
+
+    @staticmethod
+    def discard_downloads(tasks: list[asyncio.Task]):
+        """Cancel downloads that are no longer needed and close the files already downloaded"""
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif (
+                not task.cancelled()
+                and task.exception() is None
+                and isinstance(task.result(), discord.File)
+            ):
+                task.result().close()
+
+    async def transcode_video(
+        self,
+        file: IO[bytes],
+        max_filesize: int,
+        channel: "discord.abc.MessageableChannel | None",
+    ) -> IO[bytes] | None:
+        """Transcode a video to fit the limit, with a progress message if it takes a while"""
+        progress_message = None
+        last_update = monotonic()
+
+        async def show_progress(fraction: float):
+            nonlocal progress_message, last_update
+            if (
+                channel is None
+                or monotonic() - last_update < self.TRANSCODE_PROGRESS_INTERVAL
+            ):
+                return
+
+            last_update = monotonic()
+            content = f"{emojis.LOADING} Compressing video to fit the upload limit... **{fraction:.0%}**"
+            try:
+                if progress_message is None:
+                    progress_message = await channel.send(content)
+                else:
+                    await progress_message.edit(content=content)
+            except discord.errors.HTTPException:
+                pass
+
+        try:
+            return await self.bot.transcoder.transcode(
+                file, max_filesize, show_progress
+            )
+        finally:
+            if progress_message is not None:
+                try:
+                    await progress_message.delete()
+                except discord.errors.HTTPException:
+                    pass
+
+    async def stream_to_file(
+        self, response, max_filesize: int, budget: ByteBudget | None = None
+    ):
+        """Stream the response body into a spooled temporary file.
+
+        Returns None if the body turns out to be too big, runs out of the budget
+        or the download times out. The size is checked as the data comes in
+        since Content-Length can't be trusted.
+        """
+        file = tempfile.SpooledTemporaryFile(max_size=self.DOWNLOAD_SPOOL_SIZE)
+        size = 0
+        try:
+            async for chunk in response.content.iter_chunked(self.DOWNLOAD_CHUNK_SIZE):
+                if size + len(chunk) > max_filesize or (
+                    budget is not None and not budget.take(len(chunk))
+                ):
+                    break
+                size += len(chunk)
+                file.write(chunk)
+            else:
+                file.seek(0)
+                return file
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            file.close()
+            if budget is not None:
+                budget.give_back(size)
+            raise
+
+        file.close()
+        if budget is not None:
+            budget.give_back(size)
+        return None
+
+    async def cached_metadata(self, key: str) -> dict | None:
+        """Post metadata resolved earlier by any shard"""
+        value = await self.bot.embed_metadata.get(key)
+        if value is NOT_CACHED or value is None:
+            return None
+        return orjson.loads(value)
+
+    async def cache_metadata(self, key: str, data: dict, media_urls: Iterable[str]):
+        lifetime = metadata_lifetime(media_urls)
+        if lifetime > 0:
+            await self.bot.embed_metadata.set(
+                key, orjson.dumps(data).decode(), lifetime
+            )
+
     @staticmethod
     def msg_split(contents: dict) -> tuple[dict, dict]:
         extra_contents = {}
-        if len(contents.get("files", [])) > 10:
+        pending = contents.pop("pending_files", [])
+        if len(contents.get("files", [])) > 10 or pending:
             extra_contents["files"] = contents["files"][10:]
             contents["files"] = contents["files"][:10]
+            extra_contents["pending_files"] = pending
             extra_contents["view"] = contents["view"]
             contents["view"] = None
         if len(contents["content"]) > 1997:
             contents["content"] = contents["content"][:1997].rsplit(" ", 1)[0] + "..."
         return contents, extra_contents
 
+    async def finish_extra(self, extra_contents: dict) -> dict:
+        """Wait for the items of the second message that were still downloading"""
+        pending = extra_contents.pop("pending_files", [])
+        if not pending:
+            return extra_contents
+
+        try:
+            results = await asyncio.gather(*pending)
+        except BaseException:
+            self.discard_downloads(pending)
+            raise
+
+        links = []
+        for result in results:
+            if isinstance(result, discord.File):
+                extra_contents["files"].append(result)
+            else:
+                links.append(result)
+
+        if links:
+            extra_contents["content"] = "\n".join(links)
+        return extra_contents
+
     async def send(
         self,
         ctx: commands.Context,
@@ -228,10 +600,15 @@ class BaseEmbedder:
             ctx.channel, media, options=options
         )
         message_contents, extra_contents = self.msg_split(message_contents)
-        msg = await ctx.send(**message_contents)
+        try:
+            msg = await ctx.send(**message_contents)
+        except BaseException:
+            self.discard_downloads(extra_contents.get("pending_files", []))
+            raise
+
         msg_extra = None
         if extra_contents:
-            msg_extra = await ctx.send(**extra_contents)
+            msg_extra = await ctx.send(**await self.finish_extra(extra_contents))
         await self.msg_post_process(
             msg, msg_extra, message_contents, extra_contents, ctx.author
         )
@@ -246,10 +623,15 @@ class BaseEmbedder:
         """Send the media without relying on command context, for example in a message event"""
         message_contents = await self.create_message(channel, media, options=options)
         message_contents, extra_contents = self.msg_split(message_contents)
-        msg = await channel.send(**message_contents)
+        try:
+            msg = await channel.send(**message_contents)
+        except BaseException:
+            self.discard_downloads(extra_contents.get("pending_files", []))
+            raise
+
         msg_extra = None
         if extra_contents:
-            msg_extra = await channel.send(**extra_contents)
+            msg_extra = await channel.send(**await self.finish_extra(extra_contents))
 
         await self.msg_post_process(
             msg, msg_extra, message_contents, extra_contents, author
@@ -267,14 +649,20 @@ class BaseEmbedder:
         )
         message_contents, extra_contents = self.msg_split(message_contents)
         try:
-            msg = await message.reply(**message_contents, mention_author=False)
-        except discord.errors.HTTPException:
-            # the original message was deleted, so we can't reply
-            msg = await message.channel.send(**message_contents)
+            try:
+                msg = await message.reply(**message_contents, mention_author=False)
+            except discord.errors.HTTPException:
+                # the original message was deleted, so we can't reply
+                msg = await message.channel.send(**message_contents)
+        except BaseException:
+            self.discard_downloads(extra_contents.get("pending_files", []))
+            raise
 
         msg_extra = None
         if extra_contents:
-            msg_extra = await message.channel.send(**extra_contents)
+            msg_extra = await message.channel.send(
+                **await self.finish_extra(extra_contents)
+            )
 
         await self.msg_post_process(
             msg, msg_extra, message_contents, extra_contents, message.author
@@ -305,75 +693,87 @@ class InstagramEmbedder(BaseEmbedder):
     EMOJI = "<:instagram:1477035200759337073>"
     NO_RESULTS_ERROR = "Found no valid Instagram posts to embed!"
 
+    SHARE_REDIRECT_TIMEOUT = 10
+
+    # shared by every embedder so the provider stats outlive a single message
+    resolver: InstagramResolver
+
+    def __init__(self, bot: "MisoBot"):
+        super().__init__(bot)
+        if not hasattr(InstagramEmbedder, "resolver"):
+            InstagramEmbedder.resolver = InstagramResolver(bot)
+
     @staticmethod
     def extract_links(
         text: str, include_shortcodes=True
-    ) -> list[InstagramPost | InstagramStory]:
-        text = "\n".join(text.split())
-        instagram_regex = r"(?:https?:\/\/)?(?:www.)?instagram.com\/([a-zA-Z0-9\.\_\-]+)\/([a-zA-Z0-9\.\_\-]+)\/?([a-zA-Z0-9\.\_\-]+)?"
-        results: list[InstagramPost | InstagramStory] = []
-
-        def parse(fragments: tuple[str, ...], round=1):
-            url_type = fragments[0]
-            if url_type in ["p", "reel", "reels", "tv"]:
-                results.append(InstagramPost(shortcode=fragments[1]))
-            elif url_type == "stories":
-                results.append(
-                    InstagramStory(username=fragments[1], id=int(fragments[2]))
-                )
-            elif url_type == "share":
-                # get the redirect location
-                share_url = f"https://instagram.com/share/{fragments[1]}/{fragments[2]}"
-                final_url = urllib.request.urlopen(share_url).geturl()
-                new_match = regex.search(instagram_regex, final_url)
-                if new_match is not None:
-                    parse(new_match.groups())
-                else:
-                    raise InstagramError("Share link redirected to unsupported url")
-            else:
-                if round == 1:
-                    # let's assume it's username, and user clicked through the profile page for this
-                    # shift fragments over by one and try parsing again
-                    parse(fragments[1:], 2)
-                else:
-                    raise InstagramError(f"Unsupported instagram path `/{url_type}/`")
-
-        for regex_match in regex.finditer(instagram_regex, text):
-            parse(regex_match.groups())
-
+    ) -> list[InstagramPost | InstagramStory | InstagramShare]:
+        results = [
+            media for provider, media in scan_links(text) if provider == "instagram"
+        ]
         if include_shortcodes:
-            shortcode_regex = r"(?:\s|^)([^-][a-zA-Z0-9\-\_\.]{9,})(?=\s|$)"
-            for match in regex.finditer(shortcode_regex, text):
+            text = "\n".join(text.split())
+            for match in SHORTCODE_PATTERN.finditer(text):
                 results.append(InstagramPost(shortcode=match.group(1)))
 
         return results
 
+    async def resolve_share(
+        self, share: InstagramShare
+    ) -> InstagramPost | InstagramStory:
+        """Follow the redirect of a share link to the post or story it points to"""
+        try:
+            async with self.bot.session.get(
+                share.url,
+                headers={"User-Agent": util.random_user_agent()},
+                timeout=ClientTimeout(total=self.SHARE_REDIRECT_TIMEOUT),
+            ) as response:
+                final_url = str(response.url)
+        except (ClientError, asyncio.TimeoutError) as e:
+            raise InstagramError(f"Could not open the share link: {e}")
+
+        new_match = INSTAGRAM_PATTERN.search(final_url)
+        if new_match is None:
+            raise InstagramError("Share link redirected to unsupported url")
+
+        asset = instagram_asset(list(new_match.groups()))
+        if isinstance(asset, InstagramShare):
+            raise InstagramError("Share link redirected to another share link")
+        return asset
+
     async def create_message(
         self,
         channel: "discord.abc.MessageableChannel",
-        instagram_asset: InstagramPost | InstagramStory,
+        instagram_asset: InstagramPost | InstagramStory | InstagramShare,
         options: Options | None = None,
     ):
-        providers = [
-            Snapsave(self.bot.session),
-        ]
+        if isinstance(instagram_asset, InstagramShare):
+            instagram_asset = await self.resolve_share(instagram_asset)
 
         error = None
         post = None
         results = []
+        tried: set[str] = set()
 
-        for provider in providers:
+        while True:
             try:
                 if isinstance(instagram_asset, InstagramPost):
-                    post = await provider.get_post(instagram_asset.shortcode)
+                    provider, post = await self.resolver.get_post(
+                        instagram_asset.shortcode, exclude=tried
+                    )
                     identifier = instagram_asset.shortcode
                 else:  # InstagramStory
-                    post = await provider.get_story(
-                        instagram_asset.id, instagram_asset.username
+                    provider, post = await self.resolver.get_story(
+                        instagram_asset.id, instagram_asset.username, exclude=tried
                     )
                     identifier = instagram_asset.id
+            except InstagramError:
+                # every provider has been tried, report why the last media download failed
+                if error is not None:
+                    raise error
+                raise
 
-                tasks = []
+            try:
+                downloads = []
                 if not post.media:
                     raise InstagramError("Unable to fetch media for this post")
                 for n, media in enumerate(post.media, start=1):
@@ -386,27 +786,31 @@ class InstagramEmbedder(BaseEmbedder):
                             ext = None
 
                     filename = f"@{post.user.username}-{identifier}-{n}"
-                    tasks.append(
-                        self.download_media(
-                            media.url,
-                            filename,
-                            ext,
-                            filesize_limit(channel.guild),
-                            url_tags=["instagram"],
-                            spoiler=options.spoiler if options else False,
-                        )
+                    downloads.append(
+                        {
+                            "media_url": media.url,
+                            "filename": filename,
+                            "ext": ext,
+                            "max_filesize": filesize_limit(channel.guild),
+                            "url_tags": ["instagram"],
+                            "spoiler": options.spoiler if options else False,
+                            "cache_key": self.bot.media_cache.key(
+                                "instagram", identifier, n
+                            ),
+                            "expires_at": media.expires or url_expiry(media.url),
+                            "channel": channel,
+                        }
                     )
-                results = await asyncio.gather(*tasks)
+                # the first message is sent while the rest of a large carousel downloads
+                results, pending = await self.download_batched(downloads)
             except (InstagramError, DownloadError) as e:
-                logger.warning(f"{provider} failed with {e}")
+                logger.warning(f"Media from {provider} failed with {e}")
+                self.resolver.record_failure(provider)
+                tried.add(provider)
                 error = e
                 continue
-            else:
-                error = None
-                break
 
-        if error is not None:
-            raise error
+            break
 
         if not post:
             raise InstagramError("No post found")
@@ -436,6 +840,7 @@ class InstagramEmbedder(BaseEmbedder):
         return {
             "content": caption,
             "files": files,
+            "pending_files": pending,
             "view": MediaUI("View on Instagram", post.url, should_suppress=suppress),
             "suppress_embeds": suppress,
         }
@@ -447,29 +852,12 @@ class TikTokEmbedder(BaseEmbedder):
     NO_RESULTS_ERROR = "Found no TikTok links to embed!"
 
     def __init__(self, bot: "MisoBot"):
-        self.downloader = TikTokNew(bot.session)
+        self.downloader = TikTokNew(bot.session, bot.circuit_breakers.get("ssstik"))
         super().__init__(bot)
 
     @staticmethod
     def extract_links(text: str):
-        text = "\n".join(text.split())
-        video_id_pattern = (
-            r"\bhttps?:\/\/(?:m\.|www\.|vm\.|)tiktok\.com\/.*\b(?:(?:usr|v|embed|user|video|t)\/"
-            r"|\?shareId=|\&item_id=)(\d+)(\b|\S+\b)"
-        )
-
-        shortcode_pattern = r"\bhttps?:\/\/(?:vm|vt|www)\.tiktok\.com\/(t/|)(\w+)/?"
-
-        validated_urls = [
-            f"https://m.tiktok.com/v/{match.group(1)}"
-            for match in regex.finditer(video_id_pattern, text)
-        ]
-        validated_urls.extend(
-            f"https://vm.tiktok.com/{match.group(2)}"
-            for match in regex.finditer(shortcode_pattern, text)
-        )
-
-        return validated_urls
+        return [media for provider, media in scan_links(text) if provider == "tiktok"]
 
     async def create_message(
         self,
@@ -477,7 +865,13 @@ class TikTokEmbedder(BaseEmbedder):
         tiktok_url: str,
         options: Options | None = None,
     ):
-        video = await self.downloader.get_video(tiktok_url)
+        cache_key = f"tiktok:{tiktok_url.split('/')[-1]}"
+        if (cached := await self.cached_metadata(cache_key)) is not None:
+            video = TikTokVideo(**cached)
+        else:
+            video = await self.downloader.get_video(tiktok_url)
+            await self.cache_metadata(cache_key, asdict(video), [video.video_url])
+
         file = await self.download_media(
             video.video_url,
             f"{video.user}_{tiktok_url.split('/')[-1]}",
@@ -485,6 +879,8 @@ class TikTokEmbedder(BaseEmbedder):
             filesize_limit(channel.guild),
             url_tags=["tiktok"],
             spoiler=options.spoiler if options else False,
+            cache_key=self.bot.media_cache.key("tiktok", tiktok_url.split("/")[-1]),
+            channel=channel,
         )
         caption = f"{self.EMOJI} **@{video.user}**"
         if options and options.captions:
@@ -528,20 +924,11 @@ class TwitterEmbedder(BaseEmbedder):
 
     @staticmethod
     def extract_links(text: str, include_id_only=True):
-        text = "\n".join(text.split())
         results = [
-            int(match.group(2))
-            for match in regex.finditer(
-                r"(?:https?:\/\/)?(?:www.)?(?:twitter|x).com/(\w+)/status/(\d+)", text
-            )
+            media for provider, media in scan_links(text) if provider == "twitter"
         ]
-
         if include_id_only:
-            for word in text.split():
-                try:
-                    results.append(int(word))
-                except ValueError:
-                    pass
+            results.extend(int(word) for word in text.split() if word.isdecimal())
 
         return results
 
@@ -553,18 +940,34 @@ class TwitterEmbedder(BaseEmbedder):
     ):
         api_route = "https://api.fxtwitter.com/u/status/{0}"
         media_urls = []
-        tweet = None
         tries = 0
-        while tweet is None and tries < 3:
-            async with self.bot.session.get(api_route.format(tweet_id)) as response:
-                tries += 1
-                if not response.ok:
-                    if tries >= 3:
-                        raise exceptions.CommandWarning(
-                            f"Tweet with id `{tweet_id}` returned **{response.status}**!"
-                        )
-                    continue
-                tweet = await response.json()
+        cache_key = f"twitter:{tweet_id}"
+        tweet = await self.cached_metadata(cache_key)
+        was_cached = tweet is not None
+        if tweet is None:
+            # a missing tweet is not fxtwitter's fault, only server errors count against it
+            try:
+                async with self.bot.circuit_breakers.get("fxtwitter").guard(
+                    ignore=(exceptions.CommandWarning,)
+                ):
+                    while tweet is None and tries < 3:
+                        async with self.bot.session.get(
+                            api_route.format(tweet_id)
+                        ) as response:
+                            tries += 1
+                            if not response.ok:
+                                if tries >= 3:
+                                    if response.status >= 500:
+                                        response.raise_for_status()
+                                    raise exceptions.CommandWarning(
+                                        f"Tweet with id `{tweet_id}` returned **{response.status}**!"
+                                    )
+                                continue
+                            tweet = await response.json()
+            except ClientResponseError as e:
+                raise exceptions.CommandWarning(
+                    f"Tweet with id `{tweet_id}` returned **{e.status}**!"
+                )
 
         assert tweet is not None
 
@@ -591,6 +994,9 @@ class TwitterEmbedder(BaseEmbedder):
             else:
                 media_urls.append(("jpg", media["url"]))
 
+        if not was_cached:
+            await self.cache_metadata(cache_key, tweet, [url for _, url in media_urls])
+
         screen_name = tweet.get("user_screen_name") or tweet["author"]["screen_name"]
         caption = f"{self.EMOJI} **@{discord.utils.escape_markdown(screen_name)}**"
 
@@ -609,6 +1015,8 @@ class TwitterEmbedder(BaseEmbedder):
                     filesize_limit(channel.guild),
                     url_tags=["twitter"],
                     spoiler=options.spoiler if options else False,
+                    cache_key=self.bot.media_cache.key("twitter", tweet_id, n),
+                    channel=channel,
                 )
             )
 
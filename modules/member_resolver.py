@@ -0,0 +1,86 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+import asyncio
+from time import monotonic
+
+import discord
+from loguru import logger
+
+
+class MemberResolver:
+    """Resolve guild members without a REST call per member.
+
+    Members are served from the guild's member cache first, then from a short lived
+    cache of previously fetched members. Everything else is fetched over the gateway
+    in batches, and users found to not be in the guild are remembered for a while.
+    """
+
+    QUERY_BATCH_SIZE = 100
+    PRUNE_THRESHOLD = 10000
+
+    def __init__(self, ttl: int = 300, negative_ttl: int = 3600):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # (guild_id, user_id) -> (member, monotonic expiry time)
+        self.fetched: dict[tuple[int, int], tuple[discord.Member, float]] = {}
+        # (guild_id, user_id) -> monotonic expiry time
+        self.missing: dict[tuple[int, int], float] = {}
+
+    def prune(self):
+        now = monotonic()
+        if len(self.fetched) > self.PRUNE_THRESHOLD:
+            self.fetched = {k: v for k, v in self.fetched.items() if v[1] > now}
+        if len(self.missing) > self.PRUNE_THRESHOLD:
+            self.missing = {k: v for k, v in self.missing.items() if v > now}
+
+    async def resolve(
+        self, guild: discord.Guild, user_ids
+    ) -> tuple[dict[int, discord.Member], set[int]]:
+        """Returns the resolved members and the ids of users that are not in the guild.
+        Users that could not be checked at all are in neither.
+        """
+        now = monotonic()
+        members = {}
+        not_in_guild = set()
+        to_fetch = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is not None:
+                members[user_id] = member
+                continue
+
+            key = (guild.id, user_id)
+            fetched = self.fetched.get(key)
+            if fetched is not None and fetched[1] > now:
+                members[user_id] = fetched[0]
+            elif self.missing.get(key, 0) > now:
+                not_in_guild.add(user_id)
+            else:
+                to_fetch.append(user_id)
+
+        for i in range(0, len(to_fetch), self.QUERY_BATCH_SIZE):
+            batch = to_fetch[i : i + self.QUERY_BATCH_SIZE]
+            try:
+                found = await guild.query_members(
+                    user_ids=batch, limit=len(batch), cache=False
+                )
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                logger.warning(f"Failed to query members of {guild}: {e}")
+                continue
+
+            now = monotonic()
+            for member in found:
+                members[member.id] = member
+                self.fetched[(guild.id, member.id)] = (member, now + self.ttl)
+
+            for user_id in batch:
+                if user_id not in members:
+                    not_in_guild.add(user_id)
+                    self.missing[(guild.id, user_id)] = now + self.negative_ttl
+
+        if to_fetch:
+            self.prune()
+
+        return members, not_in_guild
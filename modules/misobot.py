@@ -6,7 +6,7 @@ import asyncio
 import traceback
 from dataclasses import dataclass
 from time import time
-from typing import Any
+from typing import Any, Awaitable, Callable
 
 import aiohttp
 import discord
@@ -17,9 +17,14 @@ from discord.ext import commands
 from loguru import logger
 
 from modules import cache, maria, util
+from modules.circuit_breaker import CircuitBreakers
 from modules.help import EmbedHelpCommand
+from modules.hotcache import HotCache
 from modules.keychain import Keychain
+from modules.media_cache import MediaCache
 from modules.redis import Redis
+from modules.shortener import UrlShortener
+from modules.transcoder import Transcoder
 
 
 @dataclass
@@ -45,6 +50,18 @@ class MisoContext(commands.Context):
         )
 
 
+@dataclass
+class MessageStage:
+    """Work done for every message after it has been parsed once"""
+
+    name: str
+    handler: Callable[[discord.Message, MisoContext], Awaitable[Any]]
+    # skip messages sent in DMs
+    guild_only: bool = True
+    # skip messages that invoke a command
+    skip_commands: bool = False
+
+
 class MisoBot(commands.AutoShardedBot):
     def __init__(
         self, extensions: list[str], default_prefix: str, **kwargs: dict[str, Any]
@@ -96,10 +113,24 @@ class MisoBot(commands.AutoShardedBot):
         self.version = "5.1"
         self.extensions_loaded = False
         self.redis: Redis = Redis()
+        self.embed_metadata = HotCache(
+            self.redis,
+            "embed-metadata",
+            maxsize=2000,
+            lifetime=3600,
+            negative_lifetime=60,
+        )
         self.boot_up_time: float | None = None
         self.trace_config = aiohttp.TraceConfig
         self.session: aiohttp.ClientSession
         self.donator_cache = {}
+        self.media_cache = MediaCache()
+        self.circuit_breakers = CircuitBreakers(self)
+        self.transcoder = Transcoder()
+        self.url_shortener = UrlShortener(self)
+        self.message_stages: list[MessageStage] = []
+        # stages still running, referenced so they aren't garbage collected
+        self.stage_tasks: set[asyncio.Task] = set()
         self.register_hooks()
 
     async def get_context(self, message: discord.Message):
@@ -177,9 +208,46 @@ class MisoBot(commands.AutoShardedBot):
         await self.db.cleanup()
         await super().close()
 
+    def add_message_stage(self, stage: MessageStage):
+        self.message_stages.append(stage)
+
+    def remove_message_stage(self, name: str):
+        self.message_stages = [s for s in self.message_stages if s.name != name]
+
     async def on_message(self, message: discord.Message):
-        """Overrides built-in on_message()"""
-        await super().on_message(message)
+        """Overrides built-in on_message().
+        Every message is parsed for commands only once and the context is shared with all stages.
+        The stages run concurrently in the background, so neither the command
+        nor the other stages wait for a slow stage.
+        """
+        # bots are ignored by everything, check before doing any work
+        if message.author.bot:
+            return
+
+        ctx = await self.get_context(message)
+        if self.is_ready():
+            in_guild = message.guild is not None
+            for stage in self.message_stages:
+                if (stage.guild_only and not in_guild) or (
+                    stage.skip_commands and ctx.valid
+                ):
+                    continue
+
+                task = asyncio.create_task(self.run_message_stage(stage, message, ctx))
+                self.stage_tasks.add(task)
+                task.add_done_callback(self.stage_tasks.discard)
+
+        await self.invoke(ctx)
+
+    @staticmethod
+    async def run_message_stage(
+        stage: MessageStage, message: discord.Message, ctx: MisoContext
+    ):
+        try:
+            await stage.handler(message, ctx)
+        except Exception as e:
+            logger.error(f"Unhandled exception in message stage {stage.name}")
+            traceback.print_exception(type(e), e, e.__traceback__)
 
     async def on_ready(self):
         """Overrides built-in on_ready()"""
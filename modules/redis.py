@@ -29,6 +29,21 @@ class Redis:
 
         return await self.pool.get(key)
 
+    async def get_many(self, keys: list) -> list:
+        if not self.enabled:
+            return [None] * len(keys)
+
+        return await self.pool.mget(keys)
+
+    async def set_many(self, values: dict, expiry: int | None = None):
+        if not self.enabled or not values:
+            return
+
+        async with self.pool.pipeline(transaction=False) as pipe:
+            for key, value in values.items():
+                pipe.set(key, value, ex=expiry)
+            await pipe.execute()
+
     async def close(self):
         if self.enabled:
             await self.pool.close()
@@ -0,0 +1,129 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+import asyncio
+import hashlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import arrow
+
+from modules import util
+from modules.hotcache import HotCache
+
+if TYPE_CHECKING:
+    from modules.misobot import MisoBot
+
+
+@dataclass
+class ShortenRequest:
+    long_url: str
+    tags: list[str]
+    expires_at: int | None
+    future: asyncio.Future
+
+
+class UrlShortener:
+    """Short links to media, remembered in memory and redis so repeat embeds skip shlink.
+
+    Links asked for at about the same time, like the oversized items of one post,
+    are looked up from the cache together and only the missing ones go to shlink.
+    A link is cached by the media it points to, and only until the media url expires.
+    """
+
+    BATCH_WINDOW = 0.05
+    MAX_CONCURRENT = 4
+    DEFAULT_LIFETIME = 6 * 60 * 60
+    # stop handing out a link a bit before the url behind it expires
+    EXPIRY_MARGIN = 60
+
+    def __init__(self, bot: "MisoBot"):
+        self.bot = bot
+        self.cache = HotCache(
+            bot.redis,
+            "short-url",
+            maxsize=5000,
+            lifetime=self.DEFAULT_LIFETIME,
+            negative_lifetime=300,
+        )
+        # cache key -> request waiting for the next batch
+        self.pending: dict[str, ShortenRequest] = {}
+        self.flush_task: asyncio.Task | None = None
+        self.slots = asyncio.Semaphore(self.MAX_CONCURRENT)
+
+    async def shorten(
+        self,
+        long_url: str,
+        tags: list[str] | None = None,
+        key: str | None = None,
+        expires_at: int | None = None,
+    ) -> str:
+        """Short link to the url, `key` identifies the media if the url itself changes"""
+        key = key or hashlib.sha1(long_url.encode()).hexdigest()
+        request = self.pending.get(key)
+        if request is None:
+            request = self.pending[key] = ShortenRequest(
+                long_url,
+                tags or [],
+                expires_at,
+                asyncio.get_running_loop().create_future(),
+            )
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self.flush_later())
+
+        return await asyncio.shield(request.future)
+
+    async def flush_later(self):
+        await asyncio.sleep(self.BATCH_WINDOW)
+        batch, self.pending = self.pending, {}
+        self.flush_task = None
+        try:
+            await self.resolve(batch)
+        except Exception as e:
+            for request in batch.values():
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    async def resolve(self, batch: dict[str, ShortenRequest]):
+        cached = await self.cache.get_many(batch)
+        missing = {}
+        for key, request in batch.items():
+            if isinstance(short_url := cached[key], str):
+                request.future.set_result(short_url)
+            else:
+                missing[key] = request
+
+        if not missing:
+            return
+
+        results = await asyncio.gather(
+            *(self.request(request) for request in missing.values()),
+            return_exceptions=True,
+        )
+        by_lifetime: defaultdict[int, dict[str, str]] = defaultdict(dict)
+        for (key, request), result in zip(missing.items(), results):
+            if isinstance(result, BaseException):
+                request.future.set_exception(result)
+                continue
+
+            request.future.set_result(result)
+            lifetime = self.lifetime(request.expires_at)
+            if lifetime > 0:
+                by_lifetime[lifetime][key] = result
+
+        for lifetime, values in by_lifetime.items():
+            await self.cache.set_many(values, lifetime)
+
+    async def request(self, request: ShortenRequest) -> str:
+        async with self.slots:
+            return await util.shorten_url(self.bot, request.long_url, request.tags)
+
+    def lifetime(self, expires_at: int | None) -> int:
+        if expires_at is None:
+            return self.DEFAULT_LIFETIME
+        return min(
+            expires_at - self.EXPIRY_MARGIN - arrow.utcnow().int_timestamp,
+            self.DEFAULT_LIFETIME,
+        )
@@ -10,6 +10,8 @@ from typing import Dict, Tuple
 import aiohttp
 from bs4 import BeautifulSoup
 
+from modules.circuit_breaker import CircuitBreaker
+
 
 class TiktokError(Exception):
     def __init__(self, message):
@@ -47,40 +49,44 @@ class TikTokNew:
         "DNT": "1",
     }
 
-    def __init__(self, session) -> None:
+    def __init__(self, session, breaker: CircuitBreaker) -> None:
         self.session = session
+        self.breaker = breaker
 
     async def get_video(self, url: str):
         download = None
         retries = 0
-        while retries < 3:
-            async with self.session.post(
-                self.BASE_URL + "/abc?url=dl",
-                headers=self.HEADERS,
-                data={
-                    "id": url,
-                    "locale": "en",
-                    "tt": "eEF4Vlgy",
-                },
-            ) as response:
-                response.raise_for_status()
-                text = await response.text()
-
-            soup = BeautifulSoup(text, "lxml")
-            if soup.find("li", {"class": "splide__slide"}) is not None:
-                raise TiktokError("TikTok slideshows are not supported")
-
-            download = soup.find("a", {"class": "without_watermark"})
-            if download is not None:
-                break
-
-            await asyncio.sleep(1)
-            retries += 1
+        async with self.breaker.guard():
+            while retries < 3:
+                async with self.session.post(
+                    self.BASE_URL + "/abc?url=dl",
+                    headers=self.HEADERS,
+                    data={
+                        "id": url,
+                        "locale": "en",
+                        "tt": "eEF4Vlgy",
+                    },
+                ) as response:
+                    response.raise_for_status()
+                    text = await response.text()
+
+                soup = BeautifulSoup(text, "lxml")
+                if soup.find("li", {"class": "splide__slide"}) is not None:
+                    break
+
+                download = soup.find("a", {"class": "without_watermark"})
+                if download is not None:
+                    break
+
+                await asyncio.sleep(1)
+                retries += 1
+            else:
+                raise TiktokError(
+                    "There was a problem downloading this video, try again later"
+                )
 
         if download is None:
-            raise TiktokError(
-                "There was a problem downloading this video, try again later"
-            )
+            raise TiktokError("TikTok slideshows are not supported")
 
         video_url = download.attrs["href"]
         user = soup.find("h2").text
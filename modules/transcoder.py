@@ -0,0 +1,201 @@
+# SPDX-FileCopyrightText: 2018-2025 Joonas Rautiola <mail@joinemm.dev>
+# SPDX-License-Identifier: MPL-2.0
+# https://git.joinemm.dev/miso-bot
+
+import asyncio
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import IO, Awaitable, Callable
+
+from loguru import logger
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+
+class Transcoder:
+    """Re-encodes videos with ffmpeg so they fit under a filesize limit.
+
+    At most `workers` ffmpeg processes run at once, each limited to a few threads,
+    a wall clock timeout and a cpu time budget. Jobs over the queue limit are refused
+    instead of waiting, the caller falls back to linking the video.
+    """
+
+    TIMEOUT = 120
+    CPU_BUDGET = 240
+    THREADS = 2
+    MAX_QUEUED = 4
+    AUDIO_BITRATE = 96_000
+    MIN_VIDEO_BITRATE = 150_000
+    # leave room for the container overhead and bitrate overshoot
+    SIZE_MARGIN = 0.92
+
+    def __init__(self, workers: int | None = None):
+        if workers is None:
+            workers = int(os.environ.get("TRANSCODE_WORKERS", 2))
+        self.enabled = (
+            workers > 0
+            and shutil.which("ffmpeg") is not None
+            and shutil.which("ffprobe") is not None
+        )
+        self.slots = asyncio.Semaphore(max(workers, 1))
+        self.waiting = 0
+
+    async def transcode(
+        self,
+        source: IO[bytes],
+        max_filesize: int,
+        on_progress: Callable[[float], Awaitable] | None = None,
+    ) -> IO[bytes] | None:
+        """Returns the re-encoded video opened for reading, or None if it couldn't be made to fit"""
+        if not self.enabled or self.waiting >= self.MAX_QUEUED:
+            return None
+
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        try:
+            return await self.run(source, max_filesize, on_progress)
+        finally:
+            self.slots.release()
+
+    async def run(
+        self,
+        source: IO[bytes],
+        max_filesize: int,
+        on_progress: Callable[[float], Awaitable] | None,
+    ) -> IO[bytes] | None:
+        workdir = Path(tempfile.mkdtemp(prefix="miso-transcode-"))
+        try:
+            input_path = workdir / "input.mp4"
+            output_path = workdir / "output.mp4"
+            await asyncio.to_thread(self.write_source, input_path, source)
+
+            duration = await self.probe_duration(input_path)
+            if not duration:
+                return None
+
+            video_bitrate = int(
+                max_filesize * 8 * self.SIZE_MARGIN / duration - self.AUDIO_BITRATE
+            )
+            if video_bitrate < self.MIN_VIDEO_BITRATE:
+                logger.info(
+                    f"Not transcoding {duration:.0f}s video, bitrate would be too low"
+                )
+                return None
+
+            command = [
+                "ffmpeg",
+                "-hide_banner",
+                "-loglevel",
+                "error",
+                "-nostats",
+                "-y",
+                "-i",
+                str(input_path),
+                "-c:v",
+                "libx264",
+                "-preset",
+                "veryfast",
+                "-threads",
+                str(self.THREADS),
+                "-b:v",
+                str(video_bitrate),
+                "-maxrate",
+                str(video_bitrate),
+                "-bufsize",
+                str(video_bitrate * 2),
+                "-c:a",
+                "aac",
+                "-b:a",
+                str(self.AUDIO_BITRATE),
+                "-movflags",
+                "+faststart",
+                "-progress",
+                "pipe:1",
+                str(output_path),
+            ]
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            if resource is not None:
+                try:
+                    resource.prlimit(
+                        process.pid,
+                        resource.RLIMIT_CPU,
+                        (self.CPU_BUDGET, self.CPU_BUDGET),
+                    )
+                except (OSError, AttributeError):
+                    pass
+
+            try:
+                await asyncio.wait_for(
+                    self.follow_progress(process, duration, on_progress), self.TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Transcoding timed out after {self.TIMEOUT} seconds")
+                return None
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+            if process.returncode != 0:
+                logger.warning(f"ffmpeg exited with code {process.returncode}")
+                return None
+
+            if output_path.stat().st_size >= max_filesize:
+                return None
+
+            # the open handle keeps the file around after the directory is removed
+            return output_path.open("rb")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    @staticmethod
+    def write_source(path: Path, source: IO[bytes]):
+        source.seek(0)
+        with path.open("wb") as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+
+    @staticmethod
+    async def probe_duration(path: Path) -> float | None:
+        process = await asyncio.create_subprocess_exec(
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            str(path),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await process.communicate()
+        try:
+            return float(stdout.decode().strip())
+        except ValueError:
+            return None
+
+    @staticmethod
+    async def follow_progress(
+        process: asyncio.subprocess.Process,
+        duration: float,
+        on_progress: Callable[[float], Awaitable] | None,
+    ):
+        assert process.stdout is not None
+        async for line in process.stdout:
+            key, _, value = line.decode().strip().partition("=")
+            if key == "out_time_us" and on_progress is not None and value.isdigit():
+                await on_progress(min(int(value) / 1_000_000 / duration, 1.0))
+        await process.wait()
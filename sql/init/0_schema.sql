@@ -131,16 +131,56 @@ CREATE TABLE IF NOT EXISTS guild_settings (
     PRIMARY KEY (guild_id)
 );
 
+CREATE TABLE IF NOT EXISTS logging_settings (
+    guild_id BIGINT,
+    member_log_channel_id BIGINT DEFAULT NULL,
+    ban_log_channel_id BIGINT DEFAULT NULL,
+    message_log_channel_id BIGINT DEFAULT NULL,
+    PRIMARY KEY (guild_id)
+);
 
+CREATE TABLE IF NOT EXISTS message_log_ignore (
+    guild_id BIGINT,
+    channel_id BIGINT,
+    PRIMARY KEY (channel_id)
+);
 
+CREATE TABLE IF NOT EXISTS greeter_settings (
+    guild_id BIGINT,
+    channel_id BIGINT DEFAULT NULL,
+    is_enabled BOOLEAN DEFAULT TRUE,
+    message_format VARCHAR(1024) DEFAULT NULL,
+    PRIMARY KEY (guild_id)
+);
 
+CREATE TABLE IF NOT EXISTS goodbye_settings (
+    guild_id BIGINT,
+    channel_id BIGINT DEFAULT NULL,
+    is_enabled BOOLEAN DEFAULT TRUE,
+    message_format VARCHAR(1024) DEFAULT NULL,
+    PRIMARY KEY (guild_id)
+);
 
+CREATE TABLE IF NOT EXISTS autorole (
+    guild_id BIGINT,
+    role_id BIGINT,
+    PRIMARY KEY (guild_id, role_id)
+);
 
+CREATE TABLE IF NOT EXISTS media_auto_embed_enabled (
+    guild_id BIGINT,
+    instagram BOOLEAN DEFAULT FALSE,
+    tiktok BOOLEAN DEFAULT FALSE,
+    PRIMARY KEY (guild_id)
+);
 
-
-
-
-
+CREATE TABLE IF NOT EXISTS media_auto_embed_options (
+    guild_id BIGINT,
+    provider VARCHAR(32),
+    options VARCHAR(64) DEFAULT NULL,
+    reply BOOLEAN DEFAULT FALSE,
+    PRIMARY KEY (guild_id, provider)
+);
 
 CREATE TABLE IF NOT EXISTS voting_channel (
     guild_id BIGINT,
@@ -157,6 +197,37 @@ CREATE TABLE IF NOT EXISTS muted_user (
     PRIMARY KEY (guild_id, user_id)
 );
 
+CREATE TABLE IF NOT EXISTS user_activity (
+    guild_id BIGINT,
+    user_id BIGINT,
+    h0 INT UNSIGNED NOT NULL DEFAULT 0,
+    h1 INT UNSIGNED NOT NULL DEFAULT 0,
+    h2 INT UNSIGNED NOT NULL DEFAULT 0,
+    h3 INT UNSIGNED NOT NULL DEFAULT 0,
+    h4 INT UNSIGNED NOT NULL DEFAULT 0,
+    h5 INT UNSIGNED NOT NULL DEFAULT 0,
+    h6 INT UNSIGNED NOT NULL DEFAULT 0,
+    h7 INT UNSIGNED NOT NULL DEFAULT 0,
+    h8 INT UNSIGNED NOT NULL DEFAULT 0,
+    h9 INT UNSIGNED NOT NULL DEFAULT 0,
+    h10 INT UNSIGNED NOT NULL DEFAULT 0,
+    h11 INT UNSIGNED NOT NULL DEFAULT 0,
+    h12 INT UNSIGNED NOT NULL DEFAULT 0,
+    h13 INT UNSIGNED NOT NULL DEFAULT 0,
+    h14 INT UNSIGNED NOT NULL DEFAULT 0,
+    h15 INT UNSIGNED NOT NULL DEFAULT 0,
+    h16 INT UNSIGNED NOT NULL DEFAULT 0,
+    h17 INT UNSIGNED NOT NULL DEFAULT 0,
+    h18 INT UNSIGNED NOT NULL DEFAULT 0,
+    h19 INT UNSIGNED NOT NULL DEFAULT 0,
+    h20 INT UNSIGNED NOT NULL DEFAULT 0,
+    h21 INT UNSIGNED NOT NULL DEFAULT 0,
+    h22 INT UNSIGNED NOT NULL DEFAULT 0,
+    h23 INT UNSIGNED NOT NULL DEFAULT 0,
+    message_count INT UNSIGNED NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, user_id)
+);
+
 -- caches
 CREATE TABLE IF NOT EXISTS image_color_cache (
     image_hash VARCHAR(32),